@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from corpus import load_corpus
+from evaluator import evaluate
+from instrumentation import METRICS
+from naive_bayes_classifier import NaiveBayesClassifier
+from tokenizer import DEFAULT_TOKENIZER, generate_vocabulary
+from vocabulary import HashingVocabulary
+
+try:
+    import resource
+except ImportError:
+    # The resource module is not available on Windows, peak memory is simply not reported there
+    resource = None
+# end: try-except
+
+# The headers of the generated data sets, the same as the ones of covid_training.tsv
+HEADERS = ["tweet_id", "text", "q1_label", "q2_label", "q3_label", "q4_label", "q5_label", "q6_label", "q7_label"]
+
+
+def generate_corpus(filename, tweet_count, vocabulary_size=20000, skew=0.6, words_per_tweet=20, has_headers=True,
+                    seed=0):
+    """
+    Generate a synthetic tweet data set shaped like covid_training.tsv.
+    The words are drawn from a Zipf-like distribution over the vocabulary, which is shifted for a few of the words of
+    the "no" tweets so that there is something (but not everything) for the classifier to learn, and some of the words
+    are turned into hashtags, mentions or URLs.
+    :param filename: The filename to write the data set to.
+    :param tweet_count: The number of tweets to generate.
+    :param vocabulary_size: The number of distinct words to draw from.
+    :param skew: The fraction of the tweets that are "yes" (factual) tweets.
+    :param words_per_tweet: The average number of words in a tweet.
+    :param has_headers: True to write the headers on the first line (like the training set, but not the test set).
+    :param seed: The seed of the random generator, the same seed always gives the same data set.
+    :return: void
+    """
+    rng = np.random.default_rng(seed)
+
+    # Build the word distribution, and the words themselves (with a few hashtags, mentions and URLs among them)
+    probabilities = 1.0 / np.arange(1, vocabulary_size + 1)
+    probabilities /= probabilities.sum()
+    words = []
+    for i in range(vocabulary_size):
+        word = "w" + repr(i)
+        if i % 50 == 7:
+            word = "#" + word
+        elif i % 50 == 13:
+            word = "@" + word
+        elif i % 200 == 29:
+            word = "https://t.co/" + word
+        # end: if-elif
+        words.append(word)
+    # end: for-loop
+
+    with open(filename, "w", encoding="utf-8", newline="\n") as file:
+        if has_headers:
+            file.write("\t".join(HEADERS) + "\n")
+        # end: if
+
+        # Generate the tweets in chunks, so that the memory used stays the same no matter how many tweets there are
+        written = 0
+        while written < tweet_count:
+            n = min(10000, tweet_count - written)
+            is_factual = rng.random(n) < skew
+            lengths = np.maximum(1, rng.poisson(words_per_tweet, n))
+            word_ids = rng.choice(vocabulary_size, size=int(lengths.sum()), p=probabilities)
+
+            # Shift some of the words of the "no" tweets towards other words
+            offsets = np.repeat(np.where(is_factual, 0, vocabulary_size // 10), lengths)
+            offsets[rng.random(len(offsets)) < 0.9] = 0
+            word_ids = (word_ids + offsets) % vocabulary_size
+
+            lines = []
+            end = 0
+            for i in range(n):
+                start, end = end, end + lengths[i]
+                label = "yes" if is_factual[i] else "no"
+                text = " ".join(words[word_id] for word_id in word_ids[start:end])
+                other_labels = ["NA"] * 4 if label == "no" else ["2_no_probably_contains_no_false_info",
+                                                                  "4_yes_probably_of_interest",
+                                                                  "1_no_definitely_not_harmful", "yes_not_urgent"]
+                lines.append("\t".join([repr(10 ** 18 + written + i), text, label] + other_labels +
+                                       ["no_not_harmful", "no_not_interesting"]) + "\n")
+            # end: for-loop
+            file.write("".join(lines))
+            written += n
+        # end: while
+    # end: with-file
+# end: generate_corpus
+
+
+def peak_memory():
+    """
+    Get the peak resident set size of this process so far.
+    :return: The peak RSS in megabytes, or None if it is not available on this platform.
+    """
+    if resource is None:
+        return None
+    # end: if
+
+    # Linux reports the peak in kilobytes, macOS in bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak /= 1024
+    # end: if
+    return peak / 1024
+# end: peak_memory
+
+
+def time_stage(results, name, tweet_count, repeat, function):
+    """
+    Time a stage of the pipeline, keeping the best of the repeated runs.
+    :param results: The dictionary of results to add the timings of this stage to.
+    :param name: The name of the stage.
+    :param tweet_count: The number of tweets processed by the stage (to calculate the throughput).
+    :param repeat: The number of times to run the stage.
+    :param function: The function running the stage.
+    :return: The return value of the last run of the function.
+    """
+    times = []
+    value = None
+    for _ in range(repeat):
+        # Every run starts from a cold tokenizer cache, otherwise the repeated runs would reuse the tokens of the first
+        DEFAULT_TOKENIZER.cache.clear()
+        start_time = time.perf_counter()
+        value = function()
+        times.append(time.perf_counter() - start_time)
+    # end: for-loop
+
+    best = min(times)
+    results[name] = {
+        "seconds": best,
+        "seconds_all": times,
+        "tweets_per_second": tweet_count / best if best > 0 else None,
+        "peak_rss_mb": peak_memory(),
+    }
+    return value
+# end: time_stage
+
+
+def table_bytes(classifier):
+    """
+    Get the memory used by the count and probability tables of a classifier.
+    :param classifier: The NaiveBayesClassifier.
+    :return: The number of bytes.
+    """
+    return int(classifier.term_counts.nbytes + classifier.log_numerators.nbytes)
+# end: table_bytes
+
+
+def run_benchmark(train_count=100000, test_count=20000, vocabulary_size=20000, skew=0.6, words_per_tweet=20,
+                  filter_tokens=False, repeat=3, seed=0, workers=1, hash_buckets=None):
+    """
+    Benchmark every stage of the pipeline (generate_vocabulary, train, test and evaluate) on synthetic data sets.
+    The data sets are generated from a fixed seed, and the best of the repeated runs is kept, so that the results of
+    one run can be compared with the next.
+    :param train_count: The number of tweets in the training set.
+    :param test_count: The number of tweets in the test set.
+    :param vocabulary_size: The number of distinct words in the data sets.
+    :param skew: The fraction of the tweets that are "yes" (factual) tweets.
+    :param words_per_tweet: The average number of words in a tweet.
+    :param filter_tokens: True to use the filtered vocabulary (as per the assignment specifications).
+    :param repeat: The number of times to run each stage.
+    :param seed: The seed of the random generator.
+    :param workers: The number of processes to use when reading the training set.
+    :param hash_buckets: The number of buckets of a hashing vocabulary to compare with the exact vocabulary (None to
+                         only benchmark the exact vocabulary).
+    :return: The dictionary of results.
+    """
+    results = {
+        "config": {"train_count": train_count, "test_count": test_count, "vocabulary_size": vocabulary_size,
+                   "skew": skew, "words_per_tweet": words_per_tweet, "filter_tokens": filter_tokens,
+                   "repeat": repeat, "seed": seed, "workers": workers,
+                   "hash_buckets": hash_buckets},
+        "environment": {"python": platform.python_version(), "numpy": np.__version__,
+                        "platform": platform.platform(), "cpu_count": os.cpu_count()},
+        "stages": {},
+    }
+    stages = results["stages"]
+
+    original_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # The classifier and the evaluator write to the outputs directory of the current directory
+        os.chdir(directory)
+        try:
+            os.mkdir("outputs")
+            training_set = os.path.join(directory, "training.tsv")
+            testing_set = os.path.join(directory, "testing.tsv")
+            generate_corpus(training_set, train_count, vocabulary_size, skew, words_per_tweet, True, seed)
+            generate_corpus(testing_set, test_count, vocabulary_size, skew, words_per_tweet, False, seed + 1)
+
+            vocabulary = time_stage(stages, "generate_vocabulary", train_count, repeat,
+                                    lambda: generate_vocabulary(training_set, filter_tokens))
+            classifier = NaiveBayesClassifier(vocabulary, "BENCH")
+            time_stage(stages, "train", train_count, repeat, lambda: classifier.train(training_set, workers))
+
+            # The trace file is appended to, so start from an empty one for every run of the test
+            def test():
+                if os.path.exists(classifier.output_file):
+                    os.remove(classifier.output_file)
+                # end: if
+                return classifier.test(testing_set)
+            # end: test
+            evaluator = time_stage(stages, "test", test_count, repeat, test)
+            time_stage(stages, "evaluate", test_count, repeat, lambda: evaluate("BENCH"))
+
+            # Also time reading the training set into a corpus, which the stages above share in main.py
+            time_stage(stages, "load_corpus", train_count, repeat, lambda: load_corpus(training_set, workers))
+
+            results["vocabulary_size"] = len(classifier.vocabulary)
+            results["accuracy"] = evaluator.accuracy()
+            results["table_bytes"] = table_bytes(classifier)
+
+            # Compare with a hashing vocabulary, which needs no vocabulary pass before training
+            if hash_buckets:
+                hashed = NaiveBayesClassifier(HashingVocabulary(hash_buckets), "BENCH-HASH")
+                time_stage(stages, "train_hashing", train_count, repeat, lambda: hashed.train(training_set, workers))
+
+                def test_hashing():
+                    if os.path.exists(hashed.output_file):
+                        os.remove(hashed.output_file)
+                    # end: if
+                    return hashed.test(testing_set)
+                # end: test_hashing
+                hashed_evaluator = time_stage(stages, "test_hashing", test_count, repeat, test_hashing)
+                results["hashing"] = {"buckets": hash_buckets, "accuracy": hashed_evaluator.accuracy(),
+                                      "accuracy_loss": results["accuracy"] - hashed_evaluator.accuracy(),
+                                      "table_bytes": table_bytes(hashed)}
+            # end: if
+        finally:
+            os.chdir(original_directory)
+        # end: try-finally
+    # end: with-directory
+
+    results["peak_rss_mb"] = peak_memory()
+    if METRICS.enabled:
+        results["metrics"] = METRICS.to_dict()
+    # end: if
+    return results
+# end: run_benchmark
+
+
+if __name__ == '__main__':
+    """
+    Run the benchmark from the command line, e.g. python benchmark.py --train 1000000 --output bench.json
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the train/test/evaluate pipeline on synthetic tweets.")
+    parser.add_argument("--train", type=int, default=100000, help="number of tweets in the training set")
+    parser.add_argument("--test", type=int, default=20000, help="number of tweets in the test set")
+    parser.add_argument("--vocabulary", type=int, default=20000, help="number of distinct words")
+    parser.add_argument("--skew", type=float, default=0.6, help="fraction of factual (yes) tweets")
+    parser.add_argument("--words", type=int, default=20, help="average number of words per tweet")
+    parser.add_argument("--filter", action="store_true", help="use the filtered vocabulary")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each stage (the best is kept)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data sets")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes used to read the training set")
+    parser.add_argument("--hashing", type=int, help="also benchmark a hashing vocabulary with this many buckets")
+    parser.add_argument("--metrics", action="store_true", help="also record the per-stage counters and timings")
+    parser.add_argument("--output", help="file to write the results to, as JSON")
+    arguments = parser.parse_args()
+    if arguments.metrics:
+        METRICS.enable()
+    # end: if
+
+    benchmark_results = run_benchmark(arguments.train, arguments.test, arguments.vocabulary, arguments.skew,
+                                      arguments.words, arguments.filter, arguments.repeat, arguments.seed,
+                                      arguments.workers, arguments.hashing)
+
+    # Print a summary of each stage
+    for stage_name, stage in benchmark_results["stages"].items():
+        print("%-20s %10.4f s %14.1f tweets/s" % (stage_name, stage["seconds"], stage["tweets_per_second"] or 0))
+    # end: for-loop
+    print("Peak RSS: %s MB, accuracy: %.4f" % (benchmark_results["peak_rss_mb"], benchmark_results["accuracy"]))
+    if "hashing" in benchmark_results:
+        print("Hashing (%d buckets): accuracy %.4f (loss %.4f), tables %d bytes vs %d bytes" %
+              (benchmark_results["hashing"]["buckets"], benchmark_results["hashing"]["accuracy"],
+               benchmark_results["hashing"]["accuracy_loss"], benchmark_results["hashing"]["table_bytes"],
+               benchmark_results["table_bytes"]))
+    # end: if
+
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            json.dump(benchmark_results, output, indent=2)
+        # end: with-file
+    # end: if
+# end: __main__
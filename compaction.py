@@ -0,0 +1,307 @@
+import argparse
+import json
+
+import numpy as np
+
+from corpus import load_corpus
+from evaluator import StreamingEvaluator
+from instrumentation import METRICS
+from naive_bayes_classifier import BATCH_SIZE, NaiveBayesClassifier, transform
+from tokenizer import generate_vocabulary
+from tsv_reader import read_batches
+from vocabulary import Vocabulary
+
+# The ways terms can be ranked by how much they help tell the classes apart
+RANKING_METHODS = ("log_ratio", "mutual_information")
+
+# The types the log-probabilities of a compact model can be stored as
+QUANTIZED_DTYPES = ("float64", "float32", "float16", "int8")
+
+
+class CompactClassifier:
+    """
+    A scoring-only version of a trained NaiveBayesClassifier, which keeps nothing but the log-probability tables it
+    needs to score tweets (no counts), optionally stored as float16 or int8 values.
+    int8 tables are stored with a scale and an offset per class, i.e. log_conditional = offset + scale * value, so that
+    the sum over the terms of a tweet is simply: n_terms * offset + scale * sum(value).
+    """
+
+    def __init__(self, vocabulary, model_name, tokenizer, classes, label_column, log_priors, log_conditionals,
+                 scales=None, offsets=None):
+        """
+        Constructor for the CompactClassifier class (see compact to build one from a trained NaiveBayesClassifier).
+        :param vocabulary: The Vocabulary (or HashingVocabulary) of the model.
+        :param model_name: The model name.
+        :param tokenizer: The Tokenizer of the model.
+        :param classes: The list of the classes, in order of priority for ties.
+        :param label_column: The index of the label column (target) in the records of the data sets.
+        :param log_priors: The array of the (log base 10) prior probabilities, of shape (n_classes,).
+        :param log_conditionals: The array of the (log base 10, possibly quantized) conditional probabilities, of shape
+                                 (n_classes, vocabulary size).
+        :param scales: The array of the scale of each class (None if the conditional probabilities are not quantized).
+        :param offsets: The array of the offset of each class (None if the conditional probabilities are not quantized).
+        """
+        self.vocabulary = vocabulary
+        self.model_name = model_name
+        self.tokenizer = tokenizer
+        self.classes = list(classes)
+        self.label_column = label_column
+        self.log_priors = log_priors
+        self.log_conditionals = log_conditionals
+        self.dtype = log_conditionals.dtype.name
+        self.scales = np.ones(len(self.classes)) if scales is None else scales
+        self.offsets = np.zeros(len(self.classes)) if offsets is None else offsets
+
+        # Compact models never cache their predictions (see enable_cache)
+        self.cache = None
+    # end: __init__
+
+    def enable_cache(self, max_entries=0):
+        """
+        Compact models do not support the cache of predictions of NaiveBayesClassifier, this is only here so that
+        they can be used in its place (e.g. by the scoring server).
+        :param max_entries: The maximum number of cached predictions, which must be 0.
+        :return: None, since there is no cache.
+        """
+        if max_entries > 0:
+            raise ValueError("Compact models do not support the prediction cache (use a full model instead)")
+        # end: if
+        return None
+    # end: enable_cache
+
+    def score_batch(self, texts):
+        """
+        Calculate the naive probabilities of a batch of tweets for every class.
+        :param texts: The list of tweet texts.
+        :return: The array of (log base 10) probabilities, of shape (n_tweets, n_classes).
+        """
+        return self.score_matrix(transform(self.vocabulary, self.tokenizer, texts))
+    # end: score_batch
+
+    def score_matrix(self, matrix):
+        """
+        Calculate the naive probabilities of an already built document-term matrix for every class.
+        :param matrix: The DocumentTermMatrix of the tweets (built with the vocabulary of this classifier).
+        :return: The array of (log base 10) probabilities, of shape (n_tweets, n_classes).
+        """
+        with METRICS.timer("scoring"):
+            return (matrix.dot(self.log_conditionals) * self.scales + np.outer(matrix.row_sums(), self.offsets) +
+                    self.log_priors)
+        # end: with
+    # end: score_matrix
+
+    def predict_batch(self, texts):
+        """
+        Predict the classes of a batch of tweets.
+        :param texts: The list of tweet texts.
+        :return: The list of the chosen classes, and the array of the scores of the chosen classes.
+        """
+        return self.choose_classes(self.score_batch(texts))
+    # end: predict_batch
+
+    def choose_classes(self, scores):
+        """
+        Choose the class with the highest score for every tweet (ties go to the first class).
+        :param scores: The array of probabilities, of shape (n_tweets, n_classes).
+        :return: The list of the chosen classes, and the array of the scores of the chosen classes.
+        """
+        chosen_indices = scores.argmax(axis=1)
+        return [self.classes[i] for i in chosen_indices], scores[np.arange(len(scores)), chosen_indices]
+    # end: choose_classes
+
+    def nbytes(self):
+        """
+        Get the size of the model: its tables, plus its vocabulary stored as a string table (like in a model file).
+        :return: The number of bytes.
+        """
+        vocabulary_bytes = 0
+        if isinstance(self.vocabulary, Vocabulary):
+            vocabulary_bytes = 8 * (len(self.vocabulary) + 1)
+            vocabulary_bytes += sum(len(term.encode("utf-8")) for term in self.vocabulary)
+        # end: if
+
+        return int(self.log_conditionals.nbytes + self.log_priors.nbytes + self.scales.nbytes + self.offsets.nbytes +
+                   vocabulary_bytes)
+    # end: nbytes
+# end: class CompactClassifier
+
+
+def compact(classifier, dtype="float64"):
+    """
+    Build the scoring-only version of a trained classifier.
+    :param classifier: The trained NaiveBayesClassifier.
+    :param dtype: The type to store the log-probabilities as (see QUANTIZED_DTYPES).
+    :return: The CompactClassifier.
+    """
+    if dtype not in QUANTIZED_DTYPES:
+        raise ValueError("Unknown dtype: " + repr(dtype))
+    # end: if
+
+    log_conditionals = classifier.log_conditionals
+    if dtype != "int8":
+        return CompactClassifier(classifier.vocabulary, classifier.model_name, classifier.tokenizer, classifier.classes,
+                                 classifier.label_column, np.array(classifier.log_priors, dtype=float),
+                                 log_conditionals.astype(dtype))
+    # end: if
+
+    # Spread the values of each class over the 256 levels of an int8 between their minimum and maximum
+    minimums = log_conditionals.min(axis=1) if log_conditionals.size else np.zeros(len(classifier.classes))
+    scales = (log_conditionals.max(axis=1) - minimums) / 255 if log_conditionals.size else np.ones(len(minimums))
+    scales[scales == 0] = 1.0
+    levels = np.rint((log_conditionals - minimums[:, np.newaxis]) / scales[:, np.newaxis]) - 128
+    return CompactClassifier(classifier.vocabulary, classifier.model_name, classifier.tokenizer, classifier.classes,
+                             classifier.label_column, np.array(classifier.log_priors, dtype=float),
+                             levels.astype(np.int8), scales, minimums + 128 * scales)
+# end: compact
+
+
+def rank_terms(classifier, method="log_ratio"):
+    """
+    Score every term of a trained classifier by how much it helps tell the classes apart.
+    - "log_ratio": the largest difference between the log conditional probabilities of the term in two classes, i.e.
+      |log P(term | factual) - log P(term | not factual)| with the default classes.
+    - "mutual_information": the mutual information between the class of a token and whether it is this term.
+    :param classifier: The trained NaiveBayesClassifier.
+    :param method: The ranking method (see RANKING_METHODS).
+    :return: The array of the scores of the terms, the higher the better.
+    """
+    if method == "log_ratio":
+        log_conditionals = classifier.log_conditionals
+        return log_conditionals.max(axis=0) - log_conditionals.min(axis=0)
+    # end: if
+
+    if method == "mutual_information":
+        # Treat every token of the training data as a sample of (class, is this term)
+        counts = np.asarray(classifier.term_counts, dtype=float)
+        total = counts.sum()
+        class_totals = counts.sum(axis=1, keepdims=True)
+        term_totals = counts.sum(axis=0, keepdims=True)
+        information = np.zeros(counts.shape[1])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for joint, term_marginal in ((counts, term_totals), (class_totals - counts, total - term_totals)):
+                cell = joint / total * np.log2(joint * total / (class_totals * term_marginal))
+                information += np.nan_to_num(cell, nan=0.0, posinf=0.0, neginf=0.0).sum(axis=0)
+            # end: for-loop
+        # end: with
+        return information
+    # end: if
+
+    raise ValueError("Unknown ranking method: " + repr(method))
+# end: rank_terms
+
+
+def prune(classifier, top_k, method="log_ratio"):
+    """
+    Keep only the top-k terms of a trained classifier, as ranked by rank_terms.
+    The pruned classifier is the same as one trained on the same data with a vocabulary of only those terms.
+    :param classifier: The trained NaiveBayesClassifier (with an exact vocabulary).
+    :param top_k: The number of terms to keep.
+    :param method: The ranking method (see RANKING_METHODS).
+    :return: The pruned NaiveBayesClassifier.
+    """
+    if not isinstance(classifier.vocabulary, Vocabulary):
+        raise ValueError("Only a classifier with an exact vocabulary can be pruned")
+    # end: if
+
+    # Keep the best terms, in their original order (ties are broken by keeping the first terms)
+    scores = rank_terms(classifier, method)
+    term_ids = np.sort(np.argsort(-scores, kind="stable")[:top_k])
+
+    pruned = NaiveBayesClassifier([classifier.vocabulary.terms[i] for i in term_ids], classifier.model_name,
+                                  classifier.tokenizer, list(classifier.classes), classifier.label_column,
+                                  classifier.smooth)
+    pruned.fixed_classes = classifier.fixed_classes
+    pruned.output_file = classifier.output_file
+    pruned.tweet_count = classifier.tweet_count
+    pruned.class_counts = np.array(classifier.class_counts, dtype=float)
+    pruned.term_counts = np.array(classifier.term_counts[:, term_ids], dtype=float)
+    pruned.dirty_terms[:] = True
+    pruned.is_dirty = True
+    pruned.update_probabilities()
+    return pruned
+# end: prune
+
+
+def evaluate_accuracy(model, filename):
+    """
+    Calculate the accuracy of a model on the provided test set (without writing a trace file).
+    :param model: The NaiveBayesClassifier or CompactClassifier.
+    :param filename: The filename of the test set.
+    :return: The accuracy.
+    """
+    evaluator = StreamingEvaluator(model.classes)
+    for _, texts, labels in read_batches(filename, BATCH_SIZE, label_columns=(model.label_column,)):
+        chosen_classes, _ = model.predict_batch(texts)
+        evaluator.update_batch(chosen_classes, [label.lower() for label in labels[0]])
+    # end: for-loop
+
+    return evaluator.accuracy()
+# end: evaluate_accuracy
+
+
+def tradeoff_report(classifier, testing_set, sizes, methods=RANKING_METHODS, dtypes=QUANTIZED_DTYPES):
+    """
+    Measure the accuracy and the size of every combination of pruning and quantization of a trained classifier.
+    :param classifier: The trained NaiveBayesClassifier.
+    :param testing_set: The filename of the test set.
+    :param sizes: The list of the numbers of terms to keep (None keeps every term).
+    :param methods: The list of ranking methods.
+    :param dtypes: The list of the types to store the log-probabilities as.
+    :return: The list of results, each one with its settings, size in bytes and accuracy.
+    """
+    results = []
+    for method in methods:
+        for top_k in sizes:
+            # Every term is kept without a size, which is the same for every method
+            if top_k is None and method != methods[0]:
+                continue
+            # end: if
+            pruned = classifier if top_k is None else prune(classifier, top_k, method)
+            for dtype in dtypes:
+                compact_classifier = compact(pruned, dtype)
+                results.append({"method": method if top_k is not None else None, "top_k": len(pruned.vocabulary),
+                                "dtype": dtype, "bytes": compact_classifier.nbytes(),
+                                "accuracy": evaluate_accuracy(compact_classifier, testing_set)})
+            # end: for-loop
+        # end: for-loop
+    # end: for-loop
+
+    return results
+# end: tradeoff_report
+
+
+if __name__ == '__main__':
+    """
+    Report the accuracy/size tradeoff from the command line, e.g.
+    python compaction.py datasets/covid_training.tsv datasets/covid_test_public.tsv --top-k 100 500 1000
+    """
+    parser = argparse.ArgumentParser(description="Report the accuracy and size of pruned and quantized models.")
+    parser.add_argument("training_set", help="training set to train the full model on")
+    parser.add_argument("testing_set", help="test set to measure the accuracy on")
+    parser.add_argument("--top-k", type=int, nargs="+", default=[100, 500, 1000, 2000],
+                        help="numbers of terms to keep")
+    parser.add_argument("--method", nargs="+", choices=RANKING_METHODS, default=RANKING_METHODS,
+                        help="ways of ranking the terms")
+    parser.add_argument("--dtype", nargs="+", choices=QUANTIZED_DTYPES, default=QUANTIZED_DTYPES,
+                        help="types to store the log-probabilities as")
+    parser.add_argument("--output", help="file to write the results to, as JSON")
+    arguments = parser.parse_args()
+
+    training_corpus = load_corpus(arguments.training_set)
+    full_classifier = NaiveBayesClassifier(generate_vocabulary(training_corpus), "COMPACT")
+    full_classifier.train(training_corpus)
+    report = tradeoff_report(full_classifier, arguments.testing_set, [None] + arguments.top_k, arguments.method,
+                             arguments.dtype)
+
+    for result in report:
+        print("%-20s top_k %-7d %-8s %10d bytes  accuracy %.4f" % (result["method"] or "all terms", result["top_k"],
+                                                                     result["dtype"], result["bytes"],
+                                                                     result["accuracy"]))
+    # end: for-loop
+
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            json.dump(report, output, indent=2)
+        # end: with-file
+    # end: if
+# end: __main__
@@ -0,0 +1,287 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from instrumentation import METRICS
+from tokenizer import DEFAULT_TOKENIZER
+from tsv_reader import FALLBACK_ENCODING, is_compressed, read_batches, read_headers
+
+# The number of records read at once
+BATCH_SIZE = 1024
+
+
+class Corpus:
+    """
+    The per-class term counts of a training set, gathered in a single pass over the data.
+    Both the vocabularies and the classifiers can be built from the same corpus, so the file only needs to be read once.
+    A corpus can hold several label columns (targets, e.g. q1_label to q7_label) at once: the terms of a tweet are
+    counted once for its combination of labels, and the counts of each target are added up from the combinations.
+    """
+
+    def __init__(self, tokenizer=None, label_columns=(2,), label_names=None, hashing=None):
+        """
+        Constructor for the Corpus class.
+        :param tokenizer: The Tokenizer to use (by default, the text is lower cased and split on spaces).
+        :param label_columns: The indices of the label columns in the records of the data set.
+        :param label_names: The names of the label columns (by default, the names are based on the indices).
+        :param hashing: The HashingVocabulary to count the term ids of instead of the terms themselves, so that the
+                        counts stay bounded by its number of buckets (None to count the terms).
+        """
+        if tokenizer is None:
+            tokenizer = DEFAULT_TOKENIZER
+        # end: if
+        self.tokenizer = tokenizer
+
+        # Define the label columns (targets)
+        self.label_columns = tuple(label_columns)
+        if label_names is None:
+            label_names = ["column_" + repr(column) for column in label_columns]
+        # end: if
+        self.label_names = tuple(label_names)
+        self.hashing = hashing
+
+        # Define the total number of tweets read
+        self.tweet_count = 0
+
+        # Define the number of tweets for each combination of labels (i.e. ("yes",) or ("no",) for a single target)
+        self.class_counts = {}
+
+        # Define the term counts for each combination of labels, as a dictionary of {labels: {term: count}}
+        self.term_counts = {}
+    # end: __init__
+
+    def add(self, text, labels):
+        """
+        Add a single tweet to the corpus.
+        :param text: The tweet text.
+        :param labels: The class of the tweet for each target (already in lower case), or just the class when the
+                       corpus has a single target.
+        :return: void
+        """
+        if isinstance(labels, str):
+            labels = (labels,)
+        # end: if
+
+        # Create the dictionaries for this combination of labels the first time we see it
+        if labels not in self.class_counts:
+            self.class_counts[labels] = 0
+            self.term_counts[labels] = {}
+        # end: if
+
+        # Count the tweet and its terms in the correct class
+        self.class_counts[labels] += 1
+        with METRICS.timer("tokenizing"):
+            tokens = self.tokenizer.tokenize(text)
+        # end: with
+        with METRICS.timer("counting"):
+            if self.hashing is not None:
+                tokens = self.hashing.hash_tokens(tokens)
+            # end: if
+            term_counts = self.term_counts[labels]
+            for token in tokens:
+                term_counts[token] = term_counts.get(token, 0) + 1
+            # end: for-loop
+        # end: with
+        METRICS.count("tokens_seen", len(tokens))
+
+        # Don't forget to increment the total tweet count
+        self.tweet_count += 1
+    # end: add
+
+    def merge(self, other):
+        """
+        Add the counts of another corpus (e.g. a shard read by another process) to this corpus.
+        Since the counts are purely additive, merging shards gives the same result as reading the data in one go.
+        :param other: The Corpus to merge into this one (which must have the same label columns).
+        :return: void
+        """
+        for labels in other.class_counts:
+            if labels not in self.class_counts:
+                self.class_counts[labels] = 0
+                self.term_counts[labels] = {}
+            # end: if
+            self.class_counts[labels] += other.class_counts[labels]
+
+            # Add the term counts of this combination of labels
+            add_counts(self.term_counts[labels], other.term_counts[labels])
+        # end: for-loop
+
+        self.tweet_count += other.tweet_count
+    # end: merge
+
+    def get_target_index(self, target):
+        """
+        Get the position of a target within the combinations of labels.
+        :param target: The name of the label column, or its index in the records of the data set.
+        :return: The position of the target.
+        """
+        if isinstance(target, str):
+            return self.label_names.index(target)
+        # end: if
+
+        return self.label_columns.index(target)
+    # end: get_target_index
+
+    def get_counts(self, target=2, ignore_labels=()):
+        """
+        Get the counts of a single target.
+        :param target: The name of the label column, or its index in the records of the data set.
+        :param ignore_labels: The classes whose tweets should be left out (e.g. "na" for the questions that do not
+                              apply to every tweet).
+        :return: The number of tweets, the dictionary of {class: number of tweets} and the dictionary of
+                 {class: {term: count}} of the target.
+        """
+        target_index = self.get_target_index(target)
+
+        tweet_count = 0
+        class_counts = {}
+        term_counts = {}
+        copied_labels = set()
+        for labels in self.class_counts:
+            label = labels[target_index]
+            if label in ignore_labels:
+                continue
+            # end: if
+
+            tweet_count += self.class_counts[labels]
+            class_counts[label] = class_counts.get(label, 0) + self.class_counts[labels]
+
+            # The dictionary of the first combination is used as is, it is only copied once there are more to add
+            if label not in term_counts:
+                term_counts[label] = self.term_counts[labels]
+            else:
+                if label not in copied_labels:
+                    term_counts[label] = dict(term_counts[label])
+                    copied_labels.add(label)
+                # end: if
+                add_counts(term_counts[label], self.term_counts[labels])
+            # end: if-else
+        # end: for-loop
+
+        return tweet_count, class_counts, term_counts
+    # end: get_counts
+
+    def term_frequencies(self):
+        """
+        Get the term frequencies across all of the classes.
+        :return: The dictionary of the terms and their total term frequencies.
+        """
+        frequencies = {}
+        for labels in self.term_counts:
+            add_counts(frequencies, self.term_counts[labels])
+        # end: for-loop
+
+        return frequencies
+    # end: term_frequencies
+# end: class Corpus
+
+
+def add_counts(counts, other_counts):
+    """
+    Add the provided term counts to another dictionary of term counts.
+    :param counts: The dictionary of {term: count} to add to.
+    :param other_counts: The dictionary of {term: count} to add.
+    :return: The updated counts.
+    """
+    for term, count in other_counts.items():
+        counts[term] = counts.get(term, 0) + count
+    # end: for-loop
+
+    return counts
+# end: add_counts
+
+
+def load_corpus(filename, workers=1, tokenizer=None, label_columns=(2,), hashing=None,
+                fallback_encoding=FALLBACK_ENCODING):
+    """
+    Read and tokenize the provided training file once, building the per-class term counts.
+    When using more than one worker, the file is split into byte ranges that are counted in a process pool, and the
+    resulting shards are merged together (which gives the same result as the serial path). Compressed files cannot be
+    split, so they are always read in this process.
+    Note: this relies on every record being on a single line, which is the case for the tweet datasets.
+    :param filename: The filename to use when reading in the data.
+    :param workers: The number of processes to use.
+    :param tokenizer: The Tokenizer to use (by default, the text is lower cased and split on spaces).
+    :param label_columns: The indices of the label columns to count (by default, only q1_label on the 3rd index).
+    :param hashing: The HashingVocabulary to count the term ids of instead of the terms themselves.
+    :param fallback_encoding: The encoding to use for the lines that are not valid UTF-8 (see tsv_reader.decode).
+    :return: The compiled Corpus.
+    """
+    # The first line contains the headers, which give us the names of the label columns
+    headers = read_headers(filename, fallback_encoding=fallback_encoding)
+    label_names = [headers[column] if column < len(headers) else "column_" + repr(column) for column in label_columns]
+
+    # Without any extra workers, we simply read the whole file in this process
+    file_size = os.path.getsize(filename)
+    if workers <= 1 or is_compressed(filename):
+        return load_corpus_range(filename, 0, None, tokenizer, label_columns, label_names, hashing, fallback_encoding)
+    # end: if
+
+    # Split the file into one byte range per worker
+    boundaries = [file_size * i // workers for i in range(workers + 1)]
+    ranges = [(filename, boundaries[i], boundaries[i + 1], tokenizer, label_columns, label_names, hashing,
+               fallback_encoding) for i in range(workers)]
+
+    # Count each byte range in its own process, then merge all of the shards
+    # (along with the metrics recorded by the workers, since every process has its own METRICS)
+    corpus = Corpus(tokenizer, label_columns, label_names, hashing)
+    with METRICS.timer("parallel_loading"), ProcessPoolExecutor(max_workers=workers) as executor:
+        for shard, recorded in executor.map(load_recorded_corpus_range, [METRICS.enabled] * workers, ranges):
+            corpus.merge(shard)
+            if recorded is not None:
+                METRICS.merge(recorded)
+            # end: if
+        # end: for-loop
+    # end: with-executor
+
+    return corpus
+# end: load_corpus
+
+
+def load_recorded_corpus_range(record_metrics, arguments):
+    """
+    Read and tokenize a byte range of a file in a worker process (see load_corpus_range), recording its metrics.
+    :param record_metrics: True if the metrics of the worker should be recorded and handed back.
+    :param arguments: The tuple of the arguments of load_corpus_range.
+    :return: The Corpus of this range, and the dictionary of the recorded metrics (None if not recorded).
+    """
+    if not record_metrics:
+        return load_corpus_range(*arguments), None
+    # end: if
+
+    METRICS.reset()
+    METRICS.enable()
+    corpus = load_corpus_range(*arguments)
+    recorded = METRICS.to_dict()
+    METRICS.reset()
+    return corpus, recorded
+# end: load_recorded_corpus_range
+
+
+def load_corpus_range(filename, start, end, tokenizer=None, label_columns=(2,), label_names=None, hashing=None,
+                      fallback_encoding=FALLBACK_ENCODING):
+    """
+    Read and tokenize the records of the provided file that start within the byte range [start, end).
+    :param filename: The filename to use when reading in the data.
+    :param start: The offset of the first byte of the range.
+    :param end: The offset of the first byte after the range (None for the end of the file).
+    :param tokenizer: The Tokenizer to use (by default, the text is lower cased and split on spaces).
+    :param label_columns: The indices of the label columns to count.
+    :param label_names: The names of the label columns.
+    :param hashing: The HashingVocabulary to count the term ids of instead of the terms themselves.
+    :param fallback_encoding: The encoding to use for the lines that are not valid UTF-8.
+    :return: The Corpus of this range.
+    """
+    corpus = Corpus(tokenizer, label_columns, label_names, hashing)
+
+    # Start reading the file in batches (the headers on the first line are skipped)
+    for _, texts, labels in read_batches(filename, BATCH_SIZE, True, label_columns, start, end,
+                                      fallback_encoding=fallback_encoding):
+        # Lower case the label columns, and put the labels of each tweet together
+        labels = zip(*[[label.lower() for label in column] for column in labels])
+        for text, tweet_labels in zip(texts, labels):
+            corpus.add(text, tweet_labels)
+        # end: for-loop
+    # end: for-loop
+
+    return corpus
+# end: load_corpus_range
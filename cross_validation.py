@@ -0,0 +1,235 @@
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from instrumentation import METRICS
+from naive_bayes_classifier import BATCH_SIZE, CLASSES, tokenize_batch
+from tokenizer import DEFAULT_TOKENIZER
+from tsv_reader import read_batches
+from vocabulary import Vocabulary
+
+# The smoothing values and the vocabulary frequency cutoffs tried by default
+# (a cutoff of 1 keeps every term like the original vocabulary, 2 removes the single-occurrence terms like the
+# filtered vocabulary)
+SMOOTHING_VALUES = (0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1.0)
+FREQUENCY_CUTOFFS = (1, 2, 3)
+
+
+class FoldCounts:
+    """
+    The raw per-class counts of a data set split into k folds. Every tweet is tokenized and counted once, and the
+    training counts of a fold are simply the total counts minus the counts of the fold itself, so no model ever needs
+    to be retrained.
+    """
+
+    def __init__(self, documents, targets, class_count, folds=10, seed=0):
+        """
+        Constructor for the FoldCounts class.
+        :param documents: The list of the tokens of each tweet.
+        :param targets: The list of the class index of each tweet.
+        :param class_count: The number of classes.
+        :param folds: The number of folds.
+        :param seed: The seed used to shuffle the tweets into the folds.
+        """
+        self.folds = folds
+        self.class_count = class_count
+
+        # Give every term seen in the data an id, and build the document-term matrix of every tweet
+        self.vocabulary = Vocabulary(token for tokens in documents for token in tokens)
+        self.matrix = self.vocabulary.transform(documents)
+        self.targets = np.asarray(targets, dtype=np.int64)
+        terms = len(self.vocabulary)
+
+        # Deal the tweets out into the folds, in a shuffled order
+        self.fold_of = np.empty(len(documents), dtype=np.int64)
+        self.fold_of[np.random.default_rng(seed).permutation(len(documents))] = np.arange(len(documents)) % folds
+
+        # Count the tweets and the terms of every (fold, class) pair all at once
+        rows = self.fold_of * class_count + self.targets
+        self.class_counts = np.bincount(rows, minlength=folds * class_count).reshape(folds, class_count).astype(float)
+        entry_rows = rows[self.matrix.row_ids()]
+        self.term_counts = np.bincount(entry_rows * terms + self.matrix.indices, weights=self.matrix.counts,
+                                       minlength=folds * class_count * terms).reshape(folds, class_count, terms)
+        self.total_class_counts = self.class_counts.sum(axis=0)
+        self.total_term_counts = self.term_counts.sum(axis=0)
+    # end: __init__
+
+    def training_counts(self, fold):
+        """
+        Get the counts of every fold but the provided one.
+        :param fold: The index of the held-out fold.
+        :return: The array of the class counts, of shape (n_classes,), and the array of the term counts, of shape
+                 (n_classes, n_terms).
+        """
+        return self.total_class_counts - self.class_counts[fold], self.total_term_counts - self.term_counts[fold]
+    # end: training_counts
+
+    def held_out(self, fold):
+        """
+        Get the tweets of the provided fold.
+        :param fold: The index of the fold.
+        :return: The DocumentTermMatrix of the tweets, and the array of their class indices.
+        """
+        rows = np.flatnonzero(self.fold_of == fold)
+        return self.matrix.take(rows), self.targets[rows]
+    # end: held_out
+# end: class FoldCounts
+
+
+def load_folds(filename, folds=10, tokenizer=None, label_column=2, classes=CLASSES, ignore_labels=(), seed=0):
+    """
+    Read and tokenize the provided training file once, splitting its tweets into folds.
+    :param filename: The filename of the training set.
+    :param folds: The number of folds.
+    :param tokenizer: The Tokenizer to use (by default, the text is lower cased and split on spaces).
+    :param label_column: The index of the label column (target) in the records of the data set.
+    :param classes: The classes to use, in order of priority for ties. Any other label belongs to the last class.
+    :param ignore_labels: The labels of the tweets that should be left out.
+    :param seed: The seed used to shuffle the tweets into the folds.
+    :return: The FoldCounts of the training set.
+    """
+    if tokenizer is None:
+        tokenizer = DEFAULT_TOKENIZER
+    # end: if
+
+    documents = []
+    targets = []
+    for _, texts, (labels,) in read_batches(filename, BATCH_SIZE, True, (label_column,)):
+        for tokens, label in zip(tokenize_batch(tokenizer, texts), labels):
+            label = label.lower()
+            if label in ignore_labels:
+                continue
+            # end: if
+            documents.append(tokens)
+            targets.append(classes.index(label) if label in classes else len(classes) - 1)
+        # end: for-loop
+    # end: for-loop
+
+    return FoldCounts(documents, targets, len(classes), folds, seed)
+# end: load_folds
+
+
+def evaluate_fold(class_counts, term_counts, matrix, targets, smoothing_values, cutoffs):
+    """
+    Calculate the accuracy of the model trained on the provided counts for every smoothing value and frequency cutoff.
+    For each cutoff, the log-probability tables of every smoothing value are stacked and applied to the held-out tweets
+    with a single sparse product, instead of building and training one classifier per setting.
+    :param class_counts: The array of the training class counts, of shape (n_classes,).
+    :param term_counts: The array of the training term counts, of shape (n_classes, n_terms).
+    :param matrix: The DocumentTermMatrix of the held-out tweets.
+    :param targets: The array of the class indices of the held-out tweets.
+    :param smoothing_values: The list of smoothing values.
+    :param cutoffs: The list of frequency cutoffs (a term is part of the vocabulary if it appears at least this many
+                    times in the training data).
+    :return: The array of the accuracies, of shape (n_cutoffs, n_smoothing_values).
+    """
+    smoothing_values = np.asarray(smoothing_values, dtype=float)
+    class_total = len(class_counts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_priors = np.log10(class_counts / class_counts.sum())
+    # end: with
+
+    # The numerators of every (smoothing value, class) pair, as the rows of a single table which doesn't depend on the
+    # cutoff (so it is only calculated once)
+    log_numerators = np.log10(term_counts[np.newaxis] + smoothing_values[:, np.newaxis, np.newaxis])
+    log_numerators = log_numerators.reshape(len(smoothing_values) * class_total, -1)
+
+    frequencies = term_counts.sum(axis=0)
+    accuracies = np.zeros((len(cutoffs), len(smoothing_values)))
+    for k, cutoff in enumerate(cutoffs):
+        # Only the terms that are part of the vocabulary count, both in the numerators and in the vocabulary size
+        in_vocabulary = frequencies >= cutoff
+        vocabulary_size = int(in_vocabulary.sum())
+        token_counts = matrix.dot(in_vocabulary[np.newaxis].astype(float))[:, 0]
+
+        # Leave the terms that are not part of the vocabulary out of the scores
+        masked_numerators = np.where(in_vocabulary, log_numerators, 0.0)
+        log_denominators = np.log10(class_counts + vocabulary_size * smoothing_values[:, np.newaxis])
+
+        # Score the held-out tweets for every smoothing value at once, then pick the best class of each one
+        scores = matrix.dot(masked_numerators).reshape(len(targets), len(smoothing_values), class_total)
+        scores = scores - token_counts[:, np.newaxis, np.newaxis] * log_denominators + log_priors
+        accuracies[k] = (np.argmax(scores, axis=2) == targets[:, np.newaxis]).mean(axis=0)
+    # end: for-loop
+
+    return accuracies
+# end: evaluate_fold
+
+
+def cross_validate(fold_counts, smoothing_values=SMOOTHING_VALUES, cutoffs=FREQUENCY_CUTOFFS, workers=1):
+    """
+    Run k-fold cross-validation over a grid of smoothing values and vocabulary frequency cutoffs.
+    :param fold_counts: The FoldCounts of the training set (see load_folds).
+    :param smoothing_values: The list of smoothing values.
+    :param cutoffs: The list of frequency cutoffs.
+    :param workers: The number of processes evaluating the folds.
+    :return: The dictionary of the results of every setting, sorted from the best mean accuracy to the worst, along
+             with the best setting.
+    """
+    folds = range(fold_counts.folds)
+    arguments = []
+    for fold in folds:
+        class_counts, term_counts = fold_counts.training_counts(fold)
+        matrix, targets = fold_counts.held_out(fold)
+        arguments.append((class_counts, term_counts, matrix, targets, smoothing_values, cutoffs))
+    # end: for-loop
+
+    # Evaluate the folds in a process pool, or in this process without any extra workers
+    with METRICS.timer("cross_validation"):
+        if workers <= 1:
+            fold_accuracies = [evaluate_fold(*fold_arguments) for fold_arguments in arguments]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                fold_accuracies = list(executor.map(evaluate_fold, *zip(*arguments)))
+            # end: with-executor
+        # end: if-else
+    # end: with
+    fold_accuracies = np.array(fold_accuracies)
+
+    results = []
+    for k, cutoff in enumerate(cutoffs):
+        for s, smooth in enumerate(smoothing_values):
+            results.append({"smooth": smooth, "min_frequency": cutoff,
+                            "accuracy": float(fold_accuracies[:, k, s].mean()),
+                            "accuracy_std": float(fold_accuracies[:, k, s].std()),
+                            "fold_accuracies": fold_accuracies[:, k, s].tolist()})
+        # end: for-loop
+    # end: for-loop
+    results.sort(key=lambda result: -result["accuracy"])
+
+    return {"folds": fold_counts.folds, "tweets": len(fold_counts.targets), "results": results, "best": results[0]}
+# end: cross_validate
+
+
+if __name__ == '__main__':
+    """
+    Run the cross-validation from the command line, e.g. python cross_validation.py datasets/covid_training.tsv
+    """
+    parser = argparse.ArgumentParser(description="Tune the smoothing and the vocabulary cutoff with k-fold CV.")
+    parser.add_argument("training_set", help="training set to cross-validate on")
+    parser.add_argument("--folds", type=int, default=10, help="number of folds")
+    parser.add_argument("--smooth", type=float, nargs="+", default=SMOOTHING_VALUES, help="smoothing values to try")
+    parser.add_argument("--cutoff", type=int, nargs="+", default=FREQUENCY_CUTOFFS,
+                        help="vocabulary frequency cutoffs to try (1 keeps every term)")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes evaluating the folds")
+    parser.add_argument("--seed", type=int, default=0, help="seed used to shuffle the tweets into the folds")
+    parser.add_argument("--output", help="file to write the results to, as JSON")
+    arguments = parser.parse_args()
+
+    report = cross_validate(load_folds(arguments.training_set, arguments.folds, seed=arguments.seed),
+                            arguments.smooth, arguments.cutoff, arguments.workers)
+
+    # Print the mean accuracy of every setting, the best one first
+    for result in report["results"]:
+        print("smooth %-8g min_frequency %-3d accuracy %.4f (+/- %.4f)" % (result["smooth"], result["min_frequency"],
+                                                                          result["accuracy"], result["accuracy_std"]))
+    # end: for-loop
+
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            json.dump(report, output, indent=2)
+        # end: with-file
+    # end: if
+# end: __main__
@@ -1,112 +1,215 @@
-def evaluate(model_name):
-    """
-    Evaluate the provided model.
-    :param model_name: The model name to evaluate.
-    :return: void
-    """
-    # Define the filename to be used as input (the trace file for the given model)
-    trace_file = "outputs/trace_" + model_name + ".txt"
+import numpy as np
 
-    # Define the filename to be used to output the results
-    output_file = "outputs/eval_" + model_name + ".txt"
+from instrumentation import METRICS
+from trace_writer import read_binary_trace
 
-    # We will need these variables to calculate the desired metrics
-    total_records = 0
-    total_factual = 0
-    total_not_factual = 0
-    correct_factual_count = 0
-    correct_not_factual_count = 0
-    predicted_factual_count = 0
-    predicted_not_factual_count = 0
-
-    # Let's open up the trace file and being reading the results line by line
-    file = open(trace_file, "r")
-    while True:
-        # Get the next line from the file and strip any '\n' characters found
-        line = file.readline().strip("\n")
-
-        # If the line is empty, we are done reading
-        if not line:
-            break
-        # end: if
 
-        # Split the line by the appropriate delimiter (two spaces)
-        line_values = line.split("  ")
-
-        # To Get the predicted class, use the 2nd index
-        predicted_class = line_values[1]
-
-        # To get the actual class, use the 4th index
-        target_class = line_values[3]
-
-        # To get whether the class was correctly predicted or not, use the 5th index
-        is_correct = line_values[4] == "correct"
+class StreamingEvaluator:
+    """
+    An incremental evaluator that keeps a live confusion matrix, so that the metrics are available while the
+    predictions are being made (without having to re-read the trace file afterwards).
+    Any number of classes is supported, new classes are added the first time they are seen.
+    """
 
-        # Add one to the appropriate count (only if the prediction was correct)
-        if is_correct:
-            if target_class == "yes":
-                correct_factual_count += 1
-            else:
-                correct_not_factual_count += 1
-            # end: if
+    def __init__(self, classes=()):
+        """
+        Constructor for the StreamingEvaluator class.
+        :param classes: The classes known in advance, which defines the order in which they are reported.
+        """
+        # Define the list of classes and the index of each class
+        self.classes = []
+        self.class_indices = {}
+
+        # Define the confusion matrix, with the target classes as rows and the predicted classes as columns
+        self.confusion_matrix = np.zeros((0, 0), dtype=np.int64)
+
+        for label in classes:
+            self.get_class_index(label)
+        # end: for-loop
+    # end: __init__
+
+    def get_class_index(self, label):
+        """
+        Get the index of a class, growing the confusion matrix the first time the class is seen.
+        :param label: The class.
+        :return: The index of the class.
+        """
+        index = self.class_indices.get(label)
+        if index is None:
+            index = len(self.classes)
+            self.class_indices[label] = index
+            self.classes.append(label)
+            self.confusion_matrix = np.pad(self.confusion_matrix, ((0, 1), (0, 1)))
         # end: if
 
-        # Also add one to the totals based on the predicted class
-        if predicted_class == "yes":
-            predicted_factual_count += 1
-        else:
-            predicted_not_factual_count += 1
-        # end: if
+        return index
+    # end: get_class_index
+
+    def update(self, predicted_class, target_class):
+        """
+        Add a single prediction to the confusion matrix.
+        :param predicted_class: The chosen (predicted) class.
+        :param target_class: The target (actual) class.
+        :return: void
+        """
+        predicted_index = self.get_class_index(predicted_class)
+        target_index = self.get_class_index(target_class)
+        self.confusion_matrix[target_index, predicted_index] += 1
+    # end: update
+
+    def update_batch(self, predicted_classes, target_classes):
+        """
+        Add a batch of predictions (e.g. the output of NaiveBayesClassifier.predict_batch) to the confusion matrix.
+        :param predicted_classes: The list of chosen (predicted) classes.
+        :param target_classes: The list of target (actual) classes.
+        :return: void
+        """
+        with METRICS.timer("evaluating"):
+            predicted_indices = [self.get_class_index(label) for label in predicted_classes]
+            target_indices = [self.get_class_index(label) for label in target_classes]
+            np.add.at(self.confusion_matrix, (target_indices, predicted_indices), 1)
+        # end: with
+    # end: update_batch
+
+    def total(self):
+        """
+        :return: The number of predictions seen so far.
+        """
+        return int(self.confusion_matrix.sum())
+    # end: total
+
+    def accuracy(self):
+        """
+        To calculate the accuracy, we simply need to divide the total number of correct predictions by the total.
+        :return: The accuracy.
+        """
+        return float(divide(np.trace(self.confusion_matrix), self.total()))
+    # end: accuracy
+
+    def precision(self):
+        """
+        To calculate the precision, we must divide the true positives by the sum of the true positives and false
+        positives (i.e. the number of predictions of the class).
+        :return: The array of precisions, one per class.
+        """
+        return divide(np.diag(self.confusion_matrix), self.confusion_matrix.sum(axis=0))
+    # end: precision
+
+    def recall(self):
+        """
+        To calculate the recall, we must divide the true positives by the sum of the true positives and false
+        negatives (i.e. the number of tweets that actually belong to the class).
+        :return: The array of recalls, one per class.
+        """
+        return divide(np.diag(self.confusion_matrix), self.confusion_matrix.sum(axis=1))
+    # end: recall
+
+    def f1(self, beta=1):
+        """
+        To calculate the F1-measure, we must use the appropriate formula (see slides related to Lecture 2.5)
+        We need to define a "beta" value, used to represent the relative importance of recall to precision
+        When "beta" = 1, precision and recall have the same importance
+        When "beta" > 1, recall is given more weight
+        When "beta" < 1, precision is given more weight
+        :param beta: The relative importance of recall to precision.
+        :return: The array of F-measures, one per class.
+        """
+        precision = self.precision()
+        recall = self.recall()
+        return divide((beta**2 + 1) * precision * recall, (beta**2 * precision) + recall)
+    # end: f1
+
+    def metrics(self):
+        """
+        Get all of the metrics calculated so far.
+        :return: The dictionary of the accuracy, and the precision, recall and F1-measure of every class.
+        """
+        precision = self.precision()
+        recall = self.recall()
+        f1 = self.f1()
+
+        per_class = {}
+        for i, label in enumerate(self.classes):
+            per_class[label] = {"precision": float(precision[i]), "recall": float(recall[i]), "f1": float(f1[i])}
+        # end: for-loop
+
+        return {"total": self.total(), "accuracy": float(self.accuracy()), "classes": per_class}
+    # end: metrics
+
+    def write(self, output_file):
+        """
+        Write the metrics to the provided output file.
+        It will be in the following format (with one column per class, i.e. factual and not factual):
+        "accuracy
+         factual_precision  not_factual_precision
+         factual_recall  not_factual_recall
+         factual_f1  not_factual_f1"
+        :param output_file: The filename to write the results to.
+        :return: void
+        """
+        line_to_write = "{:.4}".format(float(self.accuracy())) + "\r"
+        for values in (self.precision(), self.recall(), self.f1()):
+            line_to_write += "  ".join("{:.4}".format(float(value)) for value in values) + "\r"
+        # end: for-loop
+
+        # Write the line to the output file
+        f = open(output_file, "a")
+        f.write(line_to_write)
+        f.close()
+    # end: write
+# end: class StreamingEvaluator
+
+
+def divide(numerator, denominator):
+    """
+    Divide the provided values, giving 0 wherever the denominator is 0 (i.e. a metric that is undefined).
+    :param numerator: The numerator (a number or an array).
+    :param denominator: The denominator (a number or an array).
+    :return: The result of the division.
+    """
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    return np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape),
+                     where=denominator != 0)
+# end: divide
 
-        # Also add one to the totals based on the actual class
-        if target_class == "yes":
-            total_factual += 1
-        else:
-            total_not_factual += 1
-        # end: if
 
-        # Don't forget to add to the total count
-        total_records += 1
-    # end: while
-
-    # Don't forget to close our file connection
-    file.close()
-
-    # To calculate the accuracy, we simply need to divide the total number of correct predictions by the total
-    accuracy = (correct_factual_count + correct_not_factual_count) / total_records
-
-    # To calculate the precision, we must divide the true positives by the sum of the true positives and false positives
-    precision_factual = correct_factual_count / predicted_factual_count
-    precision_not_factual = correct_not_factual_count / predicted_not_factual_count
-
-    # To calculate the recall, we must divide the true positives by the sum of the true positives and false negatives
-    recall_factual = correct_factual_count / total_factual
-    recall_not_factual = correct_not_factual_count / total_not_factual
-
-    # To calculate the F1-measure, we must use the appropriate formula (see slides related to Lecture 2.5)
-    # We need to define a "beta" value, used to represent the relative importance of recall to precision
-    # When "beta" = 1, precision and recall have the same importance
-    # When "beta" > 1, recall is given more weight
-    # When "beta" < 1, precision is given more weight
-    beta = 1
-    f1_factual = ((beta**2 + 1) * precision_factual * recall_factual) / \
-                 ((beta**2 * precision_factual) + recall_factual)
-    f1_not_factual = ((beta**2 + 1) * precision_not_factual * recall_not_factual) / \
-                     ((beta**2 * precision_not_factual) + recall_not_factual)
-
-    # Now that we have all of our metrics calculated, we can define our output line
-    # It should be in the following format:
-    # "accuracy
-    #  factual_precision  not_factual_precision
-    #  factual_recall  not_factual_recall
-    #  factual_f1  not_factual_f1"
-    line_to_write = "{:.4}".format(accuracy) + "\r"
-    line_to_write += "{:.4}".format(precision_factual) + "  " + "{:.4}".format(precision_not_factual) + "\r"
-    line_to_write += "{:.4}".format(recall_factual) + "  " + "{:.4}".format(recall_not_factual) + "\r"
-    line_to_write += "{:.4}".format(f1_factual) + "  " + "{:.4}".format(f1_not_factual) + "\r"
-
-    # Write the line to the output file
-    f = open(output_file, "a")
-    f.write(line_to_write)
-    f.close()
+def evaluate(model_name, trace_format="text", classes=("yes", "no")):
+    """
+    Evaluate the provided model from its trace file.
+    Note: NaiveBayesClassifier.test already returns a StreamingEvaluator with the same metrics, this is only needed
+    to evaluate a trace file after the fact.
+    :param model_name: The model name to evaluate.
+    :param trace_format: The format of the trace file, either "text" or "binary" (see TraceWriter).
+    :param classes: The classes known in advance, which defines the order in which they are reported.
+    :return: The StreamingEvaluator holding the metrics.
+    """
+    # Define the filename to be used to output the results
+    output_file = "outputs/eval_" + model_name + ".txt"
+
+    evaluator = StreamingEvaluator(classes)
+    if trace_format == "binary":
+        # Binary traces hold the classes as indices into their label table
+        with METRICS.timer("trace_io"):
+            labels, _, _, chosen, targets = read_binary_trace("outputs/trace_" + model_name + ".bin")
+        # end: with
+        evaluator.update_batch([labels[i] for i in chosen], [labels[i] for i in targets])
+    else:
+        # Let's open up the trace file and read the results line by line
+        with open("outputs/trace_" + model_name + ".txt", "r", encoding="utf-8") as file:
+            for line in METRICS.timed_iter("trace_io", file):
+                if not line.strip():
+                    continue
+                # end: if
+
+                # Split the line by the appropriate delimiter (two spaces)
+                # The predicted class is on the 2nd index and the actual class is on the 4th index
+                line_values = line.rstrip("\n").split("  ")
+                evaluator.update(line_values[1], line_values[3])
+            # end: for-loop
+        # end: with-file
+    # end: if-else
+
+    evaluator.write(output_file)
+    return evaluator
 # end: evaluate
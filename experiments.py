@@ -0,0 +1,227 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from corpus import load_corpus
+from instrumentation import METRICS
+from naive_bayes_classifier import BATCH_SIZE, CLASSES, SMOOTH, NaiveBayesClassifier
+from tokenizer import DEFAULT_TOKENIZER, Tokenizer, generate_vocabulary
+from tsv_reader import FALLBACK_ENCODING, read_batches
+
+# The settings of an experiment that are not given in its configuration
+DEFAULT_CONFIG = {
+    "filter_tokens": False,
+    "smooth": SMOOTH,
+    "tokenizer": None,
+    "label_column": 2,
+    "ignore_labels": (),
+    "trace_format": "text",
+}
+
+# The data sets shared by every experiment run in a process, set once per process by share_data_sets
+SHARED_DATA_SETS = {}
+
+
+def make_config(config):
+    """
+    Fill in the settings that are missing from the configuration of an experiment.
+    A configuration is a dictionary with a unique "name" (used for its output files, like NB-BOW-OV) and any of:
+    - "filter_tokens": True to remove the single-occurrence terms from the vocabulary.
+    - "smooth": the smoothing factor.
+    - "tokenizer": the dictionary of the options of its Tokenizer (None for the default tokenizer).
+    - "label_column": the index of the label column (target) in the records of the data sets.
+    - "classes": the classes of the target (by default, "yes" and "no" for q1_label, the classes seen in training
+      otherwise).
+    - "ignore_labels": the labels of the tweets that should be left out of the training.
+    - "trace_format": the format of the trace file, either "text" or "binary".
+    :param config: The configuration of the experiment.
+    :return: The complete configuration.
+    """
+    if "name" not in config:
+        raise ValueError("Every experiment needs a name")
+    # end: if
+
+    complete = dict(DEFAULT_CONFIG)
+    complete.update(config)
+    if "classes" not in complete:
+        complete["classes"] = CLASSES if complete["label_column"] == 2 else None
+    # end: if
+    return complete
+# end: make_config
+
+
+def get_tokenizer_key(config):
+    """
+    Get the key of the tokenizer of an experiment, the experiments with the same key share the same corpus.
+    :param config: The configuration of the experiment.
+    :return: The key of the tokenizer.
+    """
+    return json.dumps(config["tokenizer"], sort_keys=True)
+# end: get_tokenizer_key
+
+
+def read_test_set(filename, label_columns, fallback_encoding=FALLBACK_ENCODING):
+    """
+    Read the provided test set once, so that it can be shared by every experiment.
+    :param filename: The filename of the test set.
+    :param label_columns: The indices of the label columns to read.
+    :param fallback_encoding: The encoding to use for the lines that are not valid UTF-8.
+    :return: The list of tweet ids, the list of tweet texts and the dictionary of {label column: list of labels}.
+    """
+    tweet_ids = []
+    texts = []
+    labels = {column: [] for column in label_columns}
+    for batch_ids, batch_texts, batch_labels in read_batches(filename, BATCH_SIZE, label_columns=label_columns,
+                                                                    fallback_encoding=fallback_encoding):
+        tweet_ids.extend(batch_ids)
+        texts.extend(batch_texts)
+        for column, column_labels in zip(label_columns, batch_labels):
+            labels[column].extend(column_labels)
+        # end: for-loop
+    # end: for-loop
+
+    return tweet_ids, texts, labels
+# end: read_test_set
+
+
+def share_data_sets(corpora, test_set, record_metrics=False):
+    """
+    Set the data sets shared by the experiments run in this process (i.e. the initializer of the worker processes, so
+    that the data sets are only sent once to each worker instead of once per experiment).
+    :param corpora: The dictionary of {tokenizer key: training Corpus}.
+    :param test_set: The test set (see read_test_set).
+    :param record_metrics: True if the worker processes should record their metrics (see run_recorded_experiment).
+    :return: void
+    """
+    SHARED_DATA_SETS["corpora"] = corpora
+    SHARED_DATA_SETS["test_set"] = test_set
+    if record_metrics:
+        # Forked workers start with a copy of what this process had already recorded
+        METRICS.reset()
+        METRICS.enable()
+    # end: if
+# end: share_data_sets
+
+
+def run_experiment(config):
+    """
+    Train and test the model of a single experiment on the shared data sets, writing its trace and evaluation files
+    (outputs/trace_<name>.txt and outputs/eval_<name>.txt).
+    :param config: The complete configuration of the experiment (see make_config).
+    :return: The dictionary of the results of the experiment (including its vocabulary, as {term: frequency}).
+    """
+    corpus = SHARED_DATA_SETS["corpora"][get_tokenizer_key(config)]
+    tweet_ids, texts, labels = SHARED_DATA_SETS["test_set"]
+    name = config["name"]
+
+    # Train the model
+    start_time = time.perf_counter()
+    vocabulary = generate_vocabulary(corpus, config["filter_tokens"])
+    classifier = NaiveBayesClassifier(vocabulary, name, corpus.tokenizer, config["classes"], config["label_column"],
+                                      config["smooth"])
+    classifier.train(corpus, ignore_labels=config["ignore_labels"])
+    train_seconds = time.perf_counter() - start_time
+
+    # Start the output files over, since they are appended to
+    eval_file = "outputs/eval_" + name + ".txt"
+    for filename in (classifier.output_file, eval_file):
+        if os.path.exists(filename):
+            os.remove(filename)
+        # end: if
+    # end: for-loop
+
+    # Test the model on the test set, in batches
+    start_time = time.perf_counter()
+    column_labels = labels[config["label_column"]]
+    batches = [(tweet_ids[i:i + BATCH_SIZE], texts[i:i + BATCH_SIZE], [column_labels[i:i + BATCH_SIZE]])
+               for i in range(0, len(tweet_ids), BATCH_SIZE)]
+    evaluator = classifier.test(batches, config["trace_format"])
+    evaluator.write(eval_file)
+    test_seconds = time.perf_counter() - start_time
+
+    return {"name": name, "config": config, "vocabulary_size": len(classifier.vocabulary), "vocabulary": vocabulary,
+            "train_seconds": train_seconds, "test_seconds": test_seconds, "metrics": evaluator.metrics()}
+# end: run_experiment
+
+
+def run_recorded_experiment(config):
+    """
+    Run a single experiment in a worker process, handing the metrics it recorded back to the main process (where they
+    are merged into its own metrics), since every process has its own METRICS.
+    :param config: The complete configuration of the experiment (see make_config).
+    :return: The dictionary of the results of the experiment, and the dictionary of its recorded metrics.
+    """
+    result = run_experiment(config)
+    recorded = METRICS.to_dict()
+    METRICS.reset()
+    return result, recorded
+# end: run_recorded_experiment
+
+
+def run_experiments(configs, training_set, testing_set, workers=1, report_file=None,
+                    fallback_encoding=FALLBACK_ENCODING):
+    """
+    Run a list of experiments, each one training and testing a model with its own configuration.
+    The data sets are only read once: the training set is read into one corpus per tokenizer (with every label column
+    the experiments need), which is shared by all of the experiments using that tokenizer. The experiments themselves
+    run in a process pool, and their results are gathered into a single report.
+    :param configs: The list of the configurations of the experiments (see make_config).
+    :param training_set: The filename of the training set.
+    :param testing_set: The filename of the test set.
+    :param workers: The number of processes to use, both to read the training set and to run the experiments.
+    :param report_file: The filename to write the report to, as JSON (None to not write it).
+    :param fallback_encoding: The encoding to use for the lines of the data sets that are not valid UTF-8.
+    :return: The dictionary of the report, with the results of every experiment in the order of the configurations.
+    """
+    configs = [make_config(config) for config in configs]
+    names = [config["name"] for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError("The names of the experiments must be unique")
+    # end: if
+
+    # Read the training set once per tokenizer, and the test set once
+    start_time = time.perf_counter()
+    label_columns = sorted(set(config["label_column"] for config in configs))
+    corpora = {}
+    for config in configs:
+        key = get_tokenizer_key(config)
+        if key not in corpora:
+            tokenizer = DEFAULT_TOKENIZER if config["tokenizer"] is None else Tokenizer(**config["tokenizer"])
+            corpora[key] = load_corpus(training_set, workers, tokenizer, label_columns, None, fallback_encoding)
+        # end: if
+    # end: for-loop
+    test_set = read_test_set(testing_set, label_columns, fallback_encoding)
+    load_seconds = time.perf_counter() - start_time
+
+    # Run the experiments, in this process without any extra workers
+    # (the metrics recorded by the workers are merged back into the metrics of this process)
+    start_time = time.perf_counter()
+    with METRICS.timer("experiments"):
+        if workers <= 1 or len(configs) == 1:
+            share_data_sets(corpora, test_set)
+            results = [run_experiment(config) for config in configs]
+        else:
+            results = []
+            with ProcessPoolExecutor(max_workers=min(workers, len(configs)), initializer=share_data_sets,
+                                     initargs=(corpora, test_set, METRICS.enabled)) as executor:
+                for result, recorded in executor.map(run_recorded_experiment, configs):
+                    results.append(result)
+                    METRICS.merge(recorded)
+                # end: for-loop
+            # end: with-executor
+        # end: if-else
+    # end: with
+
+    report = {"training_set": training_set, "testing_set": testing_set, "workers": workers,
+              "load_seconds": load_seconds, "run_seconds": time.perf_counter() - start_time, "experiments": results}
+    if report_file is not None:
+        # The vocabularies are left out of the report file, which would otherwise mostly be made of them
+        experiments = [{key: value for key, value in result.items() if key != "vocabulary"} for result in results]
+        with open(report_file, "w") as file:
+            json.dump(dict(report, experiments=experiments), file, indent=2)
+        # end: with-file
+    # end: if
+
+    return report
+# end: run_experiments
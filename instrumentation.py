@@ -0,0 +1,223 @@
+import json
+import time
+
+
+class Metrics:
+    """
+    Opt-in counters, timings and gauges recorded by the hot paths of the pipeline (CSV parsing, tokenizing, counting,
+    scoring, trace I/O and evaluating).
+    Nothing is recorded until enable() is called, and the disabled hooks cost no more than a single attribute check.
+    """
+
+    def __init__(self):
+        """
+        Constructor for the Metrics class.
+        """
+        self.enabled = False
+        self.counters = {}
+        self.timings = {}
+        self.gauges = {}
+    # end: __init__
+
+    def enable(self):
+        """
+        Start recording.
+        :return: void
+        """
+        self.enabled = True
+    # end: enable
+
+    def disable(self):
+        """
+        Stop recording (what has already been recorded is kept).
+        :return: void
+        """
+        self.enabled = False
+    # end: disable
+
+    def reset(self):
+        """
+        Forget everything that has been recorded so far.
+        :return: void
+        """
+        self.counters = {}
+        self.timings = {}
+        self.gauges = {}
+    # end: reset
+
+    def count(self, name, value=1):
+        """
+        Add to a counter.
+        :param name: The name of the counter.
+        :param value: The value to add.
+        :return: void
+        """
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+        # end: if
+    # end: count
+
+    def gauge(self, name, value):
+        """
+        Set a gauge (a value that is replaced rather than added to, e.g. the memory used by a table).
+        :param name: The name of the gauge.
+        :param value: The value.
+        :return: void
+        """
+        if self.enabled:
+            self.gauges[name] = value
+        # end: if
+    # end: gauge
+
+    def add_time(self, name, seconds):
+        """
+        Add to a timing.
+        :param name: The name of the stage.
+        :param seconds: The number of seconds spent in the stage.
+        :return: void
+        """
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = {"seconds": 0.0, "calls": 0}
+        # end: if
+        timing["seconds"] += seconds
+        timing["calls"] += 1
+    # end: add_time
+
+    def merge(self, recorded):
+        """
+        Add what was recorded elsewhere (e.g. by a worker process) to these metrics: the counters and timings are added
+        up, and the gauges are replaced.
+        :param recorded: The dictionary of the recorded metrics (see to_dict).
+        :return: void
+        """
+        for name, value in recorded["counters"].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        # end: for-loop
+        for name, timing in recorded["timings"].items():
+            total = self.timings.setdefault(name, {"seconds": 0.0, "calls": 0})
+            total["seconds"] += timing["seconds"]
+            total["calls"] += timing["calls"]
+        # end: for-loop
+        self.gauges.update(recorded["gauges"])
+    # end: merge
+
+    def timer(self, name):
+        """
+        Time a stage of the pipeline, to be used as: with METRICS.timer("scoring"): ...
+        :param name: The name of the stage.
+        :return: The context manager timing the stage.
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        # end: if
+
+        return Timer(self, name)
+    # end: timer
+
+    def timed_iter(self, name, iterable, counter=None):
+        """
+        Time how long it takes to get each item of an iterable (e.g. the rows of a CSV reader).
+        :param name: The name of the stage.
+        :param iterable: The iterable.
+        :param counter: The name of the counter to add the number of items to.
+        :return: The iterable itself when disabled, otherwise a generator of its items.
+        """
+        if not self.enabled:
+            return iterable
+        # end: if
+
+        return self.generate_timed(name, iter(iterable), counter)
+    # end: timed_iter
+
+    def generate_timed(self, name, iterator, counter):
+        """
+        Generate the items of the iterator, timing each of them (see timed_iter).
+        :return: The generator of items.
+        """
+        while True:
+            start_time = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - start_time)
+                return
+            # end: try-except
+            self.add_time(name, time.perf_counter() - start_time)
+            if counter is not None:
+                self.count(counter)
+            # end: if
+
+            yield item
+        # end: while
+    # end: generate_timed
+
+    def to_dict(self):
+        """
+        Get everything that has been recorded, along with the rates derived from it.
+        :return: The dictionary of the counters, timings, gauges and derived rates.
+        """
+        derived = {}
+        tokens_scored = self.counters.get("tokens_scored", 0)
+        if tokens_scored:
+            derived["out_of_vocabulary_rate"] = self.counters.get("tokens_out_of_vocabulary", 0) / tokens_scored
+        # end: if
+
+        return {"counters": dict(self.counters), "timings": {k: dict(v) for k, v in self.timings.items()},
+                "gauges": dict(self.gauges), "derived": derived}
+    # end: to_dict
+
+    def dump(self, filename):
+        """
+        Write everything that has been recorded to a JSON file.
+        :param filename: The filename to write to.
+        :return: void
+        """
+        with open(filename, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+        # end: with-file
+    # end: dump
+# end: class Metrics
+
+
+class Timer:
+    """
+    The context manager returned by Metrics.timer when recording.
+    """
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start_time = 0.0
+    # end: __init__
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+    # end: __enter__
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.add_time(self.name, time.perf_counter() - self.start_time)
+    # end: __exit__
+# end: class Timer
+
+
+class NullTimer:
+    """
+    The context manager returned by Metrics.timer when not recording, which does nothing.
+    """
+
+    def __enter__(self):
+        return self
+    # end: __enter__
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+    # end: __exit__
+# end: class NullTimer
+
+
+NULL_TIMER = NullTimer()
+
+# The metrics shared by the whole pipeline
+METRICS = Metrics()
@@ -1,10 +1,10 @@
 import os
+import sys
 import glob
 import datetime
 
-from tokenizer import generate_vocabulary
-from naive_bayes_classifier import NaiveBayesClassifier
-from evaluator import evaluate
+from experiments import run_experiments
+from instrumentation import METRICS
 
 
 def clear_old_outputs():
@@ -36,46 +36,48 @@ if __name__ == '__main__':
     # Before we get started, let's clean up any old outputs files left by a previous run
     clear_old_outputs()
 
+    # Record the per-stage counters and timings if asked to (i.e. python main.py --metrics)
+    if "--metrics" in sys.argv:
+        METRICS.enable()
+    # end: if
+
     # Let's define the two filenames that will contain our training and testing data sets
     training_set = "datasets/covid_training.tsv"
     testing_set = "datasets/covid_test_public.tsv"
 
-    # Let's tokenize the training set to get our vocabulary
-    # We want to have two versions of our vocabulary, one containing ALL WORDS in the training set
-    original_vocabulary = generate_vocabulary(training_set, False)
+    # Let's define the models to compare, one per configuration (see experiments.make_config for the other settings)
+    # The first one uses ALL WORDS in the training set, the other one removes all of the words that only appear once
+    experiments = [
+        {"name": "NB-BOW-OV", "filter_tokens": False},
+        {"name": "NB-BOW-FV", "filter_tokens": True},
+    ]
 
-    # And the other version will be filtered, removing all of the words that only appear once
-    filtered_vocabulary = generate_vocabulary(training_set, True)
+    # Train and test every model, in parallel (the data sets are only read once and shared by all of the models)
+    # The trace and evaluation files of each model are written to the outputs directory, along with a single report
+    print("Starting the classification of the test set using models: " + ", ".join(e["name"] for e in experiments) +
+          "... ", end='')
+    start_time = datetime.datetime.now()
+    report = run_experiments(experiments, training_set, testing_set, len(experiments), "outputs/experiments.json")
+    execution_time = datetime.datetime.now() - start_time
+    print("Done! (took %.4f ms)" % (execution_time.total_seconds() * 1000))
 
     # Print our the vocabularies in case we want to take a peek
-    print("Here are the two vocabularies used:")
-    print("Original Vocabulary (size: " + repr(len(original_vocabulary)) + "): ", end='')
-    print(original_vocabulary)
-    print("Filtered Vocabulary (size: " + repr(len(filtered_vocabulary)) + "): ", end='')
-    print(filtered_vocabulary)
+    print("Here are the vocabularies used:")
+    for result in report["experiments"]:
+        print(result["name"] + " Vocabulary (size: " + repr(len(result["vocabulary"])) + "): ", end='')
+        print(result["vocabulary"])
+    # end: for-loop
     print("")
 
-    # Create two NaiveBayesClassifiers, one for each vocabulary
-    nb1 = NaiveBayesClassifier(original_vocabulary, "NB-BOW-OV")
-    nb2 = NaiveBayesClassifier(filtered_vocabulary, "NB-BOW-FV")
-
-    # Start the first classification
-    print("Starting the classification of the test set using model: NB-BOW-OV... ", end='')
-    start_time = datetime.datetime.now()
-    nb1.train(training_set)
-    nb1.test(testing_set)
-    execution_time = datetime.datetime.now() - start_time
-    print("Done! (took %.4f ms)" % (execution_time.microseconds / 1000))
-
-    # Start the second classification
-    print("Starting the classification of the test set using model: NB-BOW-FV... ", end='')
-    start_time = datetime.datetime.now()
-    nb2.train(training_set)
-    nb2.test(testing_set)
-    execution_time = datetime.datetime.now() - start_time
-    print("Done! (took %.4f ms)" % (execution_time.microseconds / 1000))
+    # Print out how each of the models did
+    for result in report["experiments"]:
+        print("%s (vocabulary size: %d): accuracy %.4f (trained in %.4f ms, tested in %.4f ms)" %
+              (result["name"], result["vocabulary_size"], result["metrics"]["accuracy"],
+               result["train_seconds"] * 1000, result["test_seconds"] * 1000))
+    # end: for-loop
 
-    # After the classifiers are done, we can evaluate how well they did
-    evaluate("NB-BOW-OV")
-    evaluate("NB-BOW-FV")
+    # Write out the metrics that were recorded during the run
+    if METRICS.enabled:
+        METRICS.dump("outputs/metrics.json")
+    # end: if
 # end: __main__
@@ -0,0 +1,233 @@
+import json
+import mmap
+import struct
+
+import numpy as np
+
+from compaction import CompactClassifier
+from naive_bayes_classifier import NaiveBayesClassifier
+from tokenizer import Tokenizer
+from vocabulary import HashingVocabulary, MappedVocabulary, Vocabulary, hash_terms
+
+# The magic bytes at the start of a model file, followed by the format version and the size of the JSON header
+MODEL_MAGIC = b"NBMODEL\0"
+MODEL_HEADER = struct.Struct("<8sII")
+
+# The version of the model format written by save_model (load_model reads this version and older)
+# Version 2 added the models using a hashing vocabulary (which have an empty string table) and the compact models
+# Version 3 added the sorted table of the hashes of the terms, so that the vocabulary can be used in place
+FORMAT_VERSION = 3
+
+# Every section of the file starts on a multiple of this many bytes, so the arrays can be used in place
+ALIGNMENT = 64
+
+
+def save_model(classifier, filename):
+    """
+    Save a trained classifier to a compact binary model file.
+    The file is made up of a fixed header, a JSON header describing the model and where each section is, and the
+    sections themselves: the vocabulary string table (the UTF-8 encoded terms one after the other, with their
+    offsets, and the sorted hashes of the terms with their ids), the class counts and priors, the term counts and the log-probability tables.
+    A CompactClassifier is saved with only its (possibly quantized) log-probability tables, along with their scales
+    and offsets.
+    :param classifier: The NaiveBayesClassifier or CompactClassifier to save.
+    :param filename: The filename of the model file.
+    :return: void
+    """
+    if isinstance(classifier, CompactClassifier):
+        header = {
+            "model_name": classifier.model_name,
+            "classes": list(classifier.classes),
+            "label_column": classifier.label_column,
+            "tokenizer": classifier.tokenizer.config(),
+            "hashing": get_hashing_config(classifier.vocabulary),
+            "compact": True,
+        }
+        log_conditionals = classifier.log_conditionals
+        sections = get_vocabulary_sections(classifier.vocabulary) + [
+            ("log_priors", np.asarray(classifier.log_priors, dtype="<f8")),
+            ("log_conditionals", np.asarray(log_conditionals, dtype=log_conditionals.dtype.newbyteorder("<"))),
+            ("scales", np.asarray(classifier.scales, dtype="<f8")),
+            ("offsets", np.asarray(classifier.offsets, dtype="<f8")),
+        ]
+        write_model_file(filename, header, sections)
+        return
+    # end: if
+
+    # Make sure the probabilities are up to date with the counts before saving them
+    classifier.update_probabilities()
+
+    sections = get_vocabulary_sections(classifier.vocabulary) + [
+        ("class_counts", np.asarray(classifier.class_counts, dtype="<f8")),
+        ("log_priors", np.asarray(classifier.log_priors, dtype="<f8")),
+        ("log_denominators", np.asarray(classifier.log_denominators, dtype="<f8")),
+        ("log_numerators", np.asarray(classifier.log_numerators, dtype="<f8")),
+        ("term_counts", np.asarray(classifier.term_counts, dtype="<f8")),
+    ]
+
+    # Describe the model, and where each of the sections will be (relative to the end of the headers)
+    header = {
+        "model_name": classifier.model_name,
+        "output_file": classifier.output_file,
+        "classes": list(classifier.classes),
+        "fixed_classes": classifier.fixed_classes,
+        "label_column": classifier.label_column,
+        "smooth": classifier.smooth,
+        "tokenizer": classifier.tokenizer.config(),
+        "tweet_count": classifier.tweet_count,
+        "hashing": get_hashing_config(classifier.vocabulary),
+    }
+    write_model_file(filename, header, sections)
+# end: save_model
+
+
+def get_vocabulary_sections(vocabulary):
+    """
+    Build the sections of the vocabulary string table (a hashing vocabulary has no terms to store, only its settings).
+    :param vocabulary: The Vocabulary or HashingVocabulary.
+    :return: The list of the (name, array) sections.
+    """
+    encoded_terms = []
+    if not isinstance(vocabulary, HashingVocabulary):
+        encoded_terms = [term.encode("utf-8") for term in vocabulary]
+    # end: if
+    term_offsets = np.zeros(len(encoded_terms) + 1, dtype="<u8")
+    np.cumsum([len(term) for term in encoded_terms], out=term_offsets[1:])
+
+    # The hashes of the terms are sorted, so that the ids can be found with a binary search (see MappedVocabulary)
+    term_hashes = hash_terms(encoded_terms)
+    hash_ids = np.argsort(term_hashes, kind="stable")
+
+    return [("term_offsets", term_offsets), ("term_bytes", np.frombuffer(b"".join(encoded_terms), dtype="u1")),
+            ("term_hashes", term_hashes[hash_ids].astype("<u8")), ("hash_ids", hash_ids.astype("<u8"))]
+# end: get_vocabulary_sections
+
+
+def get_hashing_config(vocabulary):
+    """
+    Get the settings of a hashing vocabulary to store in the header.
+    :param vocabulary: The Vocabulary or HashingVocabulary.
+    :return: The settings, or None for an exact vocabulary.
+    """
+    if isinstance(vocabulary, HashingVocabulary):
+        return vocabulary.config()
+    # end: if
+    return None
+# end: get_hashing_config
+
+
+def write_model_file(filename, header, sections):
+    """
+    Write a model file.
+    :param filename: The filename of the model file.
+    :param header: The dictionary describing the model (where each section is gets added to it).
+    :param sections: The list of the (name, array) sections.
+    :return: void
+    """
+    header["sections"] = {}
+    offset = 0
+    for name, array in sections:
+        header["sections"][name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset = align(offset + array.nbytes)
+    # end: for-loop
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = align(MODEL_HEADER.size + len(header_bytes))
+
+    # Write the headers, then each of the sections at their aligned offsets
+    with open(filename, "wb") as file:
+        file.write(MODEL_HEADER.pack(MODEL_MAGIC, FORMAT_VERSION, len(header_bytes)))
+        file.write(header_bytes)
+        for name, array in sections:
+            file.seek(data_start + header["sections"][name]["offset"])
+            file.write(array.tobytes())
+        # end: for-loop
+        file.truncate(data_start + offset)
+    # end: with-file
+# end: write_model_file
+
+
+def load_model(filename, writable=False):
+    """
+    Load a classifier from a model file written by save_model.
+    The file is memory-mapped and the tables of the classifier (along with its vocabulary) are used straight from the
+    mapping, so every process loading the same file shares a single read-only copy of them.
+    :param filename: The filename of the model file.
+    :param writable: True if the classifier should be able to be updated further (e.g. with partial_fit), in which
+                     case the pages that are changed are copied privately instead of being shared.
+    :return: The loaded NaiveBayesClassifier (or CompactClassifier, which is always read-only).
+    """
+    with open(filename, "rb") as file:
+        access = mmap.ACCESS_READ
+        if writable:
+            access = mmap.ACCESS_COPY
+        # end: if
+        buffer = mmap.mmap(file.fileno(), 0, access=access)
+    # end: with-file
+
+    # Check the headers
+    magic, version, header_size = MODEL_HEADER.unpack_from(buffer, 0)
+    if magic != MODEL_MAGIC:
+        raise ValueError(filename + " is not a model file")
+    # end: if
+    if version > FORMAT_VERSION:
+        raise ValueError(filename + " uses model format version " + repr(version) + ", which is not supported")
+    # end: if
+    header = json.loads(bytes(buffer[MODEL_HEADER.size:MODEL_HEADER.size + header_size]).decode("utf-8"))
+    data_start = align(MODEL_HEADER.size + header_size)
+
+    # Map each of the sections as an array
+    arrays = {}
+    for name, section in header["sections"].items():
+        dtype = np.dtype(section["dtype"])
+        count = int(np.prod(section["shape"]))
+        array = np.frombuffer(buffer, dtype=dtype, count=count, offset=data_start + section["offset"])
+        arrays[name] = array.reshape(section["shape"])
+    # end: for-loop
+
+    # Use the vocabulary in place, the files written before version 3 have no table of hashes so it is rebuilt instead
+    if header.get("hashing") is not None:
+        vocabulary = HashingVocabulary(**header["hashing"])
+    elif "term_hashes" in arrays:
+        vocabulary = MappedVocabulary(arrays["term_offsets"], arrays["term_bytes"], arrays["term_hashes"],
+                                      arrays["hash_ids"])
+    else:
+        term_offsets = arrays["term_offsets"].tolist()
+        term_bytes = arrays["term_bytes"].tobytes()
+        vocabulary = Vocabulary(term_bytes[term_offsets[i]:term_offsets[i + 1]].decode("utf-8")
+                                for i in range(len(term_offsets) - 1))
+    # end: if-else
+
+    # A compact model is made up of its tables only
+    tokenizer = Tokenizer(**header.get("tokenizer", {}))
+    if header.get("compact"):
+        return CompactClassifier(vocabulary, header["model_name"], tokenizer, header["classes"], header["label_column"],
+                                 arrays["log_priors"], arrays["log_conditionals"], arrays["scales"], arrays["offsets"])
+    # end: if
+
+    # Create an empty classifier and set its tables to the mapped arrays
+    classifier = NaiveBayesClassifier(Vocabulary(), header.get("model_name", ""), tokenizer, header["classes"],
+                                      header.get("label_column", 2))
+    classifier.fixed_classes = header.get("fixed_classes", True)
+    classifier.vocabulary = vocabulary
+    classifier.output_file = header["output_file"]
+    classifier.smooth = header["smooth"]
+    classifier.tweet_count = header["tweet_count"]
+    classifier.class_counts = arrays["class_counts"]
+    classifier.term_counts = arrays["term_counts"]
+    classifier.log_priors = arrays["log_priors"]
+    classifier.log_denominators = arrays["log_denominators"]
+    classifier.log_numerators = arrays["log_numerators"]
+    classifier.dirty_terms = np.zeros(len(vocabulary), dtype=bool)
+    classifier.is_dirty = False
+    return classifier
+# end: load_model
+
+
+def align(offset):
+    """
+    Round the provided offset up to the next multiple of the alignment.
+    :param offset: The offset.
+    :return: The aligned offset.
+    """
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+# end: align
@@ -1,5 +1,29 @@
-import csv
-import math
+import os
+
+import numpy as np
+
+from corpus import Corpus, load_corpus
+from evaluator import StreamingEvaluator
+from instrumentation import METRICS
+from prediction_cache import MAX_ENTRIES, PredictionCache
+from tokenizer import DEFAULT_TOKENIZER
+from trace_writer import TraceWriter
+from tsv_reader import FALLBACK_ENCODING, read_batches
+from vocabulary import HashingVocabulary, Vocabulary
+
+# The classes that a tweet can belong to, the "factual" class comes first
+CLASSES = ("yes", "no")
+
+# The default smoothing factor, which is added to every term count
+SMOOTH = 0.01
+
+# The number of tweets that are scored at once when testing
+BATCH_SIZE = 1024
+
+# The label columns of the data sets (q1_label to q7_label), and the labels of the tweets that a question does not
+# apply to (e.g. questions 2 to 5 are only answered for the tweets that contain a claim)
+LABEL_COLUMNS = (2, 3, 4, 5, 6, 7, 8)
+NOT_APPLICABLE = ("na",)
 
 
 class NaiveBayesClassifier:
@@ -7,179 +31,417 @@ class NaiveBayesClassifier:
     A custom Naive Bayes Classifier to be executed on the Covid-19 tweet data.
     """
 
-    def __init__(self, vocabulary, model_name):
+    def __init__(self, vocabulary, model_name, tokenizer=None, classes=CLASSES, label_column=2, smooth=SMOOTH):
         """
         Constructor for the NaiveBayesClassifier class.
-        :param vocabulary The vocabulary to use.
+        :param vocabulary The vocabulary to use (either a Vocabulary, a HashingVocabulary or the dictionary from
+                          generate_vocabulary).
         :param model_name The model name to use when generating the output files (i.e. NB-BOW-OV or NB-BOW-FV)
+        :param tokenizer The Tokenizer to use, which should be the same one the vocabulary was built with
+                         (by default, the text is lower cased and split on spaces).
+        :param classes The classes to use, in order of priority for ties. Any other label belongs to the last class
+                       (i.e. "not factual" by default). If None, the classes are added as they are seen in training.
+        :param label_column The index of the label column (target) in the records of the data sets.
+        :param smooth The smoothing factor (see cross_validation.py to pick one).
         """
+        # Set the tokenizer shared with the corpus and the vocabulary
+        if tokenizer is None:
+            tokenizer = DEFAULT_TOKENIZER
+        # end: if
+        self.tokenizer = tokenizer
+
         # Set the vocabulary and output file name using the provided model name
+        # Every term is given an integer id once, which is used to index all of the tables below
+        if not isinstance(vocabulary, (Vocabulary, HashingVocabulary)):
+            vocabulary = Vocabulary(vocabulary)
+        # end: if
         self.vocabulary = vocabulary
+        self.model_name = model_name
         self.output_file = "outputs/trace_" + model_name + ".txt"
 
         # Define the smoothing factor
-        self.smooth = 0.01
+        self.smooth = smooth
+
+        # Define the classes, by default the "factual" class is the first one (so it wins any ties)
+        self.label_column = label_column
+        self.fixed_classes = classes is not None
+        self.classes = []
+        self.class_indices = {}
+        for label in classes or ():
+            self.class_indices[label] = len(self.classes)
+            self.classes.append(label)
+        # end: for-loop
 
         # Define the necessary counts that will be used in calculations
         self.tweet_count = 0
-        self.factual_count = 0
-        self.not_factual_count = 0
-
-        # Define the PRIOR probabilities
-        self.prob_is_factual = 0
-        self.prob_is_not_factual = 0
-
-        # Define the dictionaries for the term counts
-        self.factual_term_counts = {}
-        self.not_factual_term_counts = {}
-
-        # Initialize these dictionaries to contain all of the words in our provided vocabulary
-        # Start off the value of each word by the smoothing factor
-        for term in vocabulary:
-            self.factual_term_counts[term] = self.smooth
-            self.not_factual_term_counts[term] = self.smooth
-        # end: for-loop
+        self.class_counts = np.zeros(len(self.classes))
+
+        # Define the term counts, as an array of shape (n_classes, vocabulary size)
+        self.term_counts = np.zeros((len(self.classes), len(self.vocabulary)))
+
+        # Define the PRIOR probabilities (stored as log base 10)
+        self.log_priors = np.zeros(len(self.classes))
+
+        # The conditional probabilities are stored as the log of their numerators (the smoothed term counts) and the
+        # log of their denominators (one per class), so that a change in the counts only requires the numerators of
+        # the terms that changed to be recalculated
+        self.log_numerators = np.full((len(self.classes), len(self.vocabulary)), np.log10(self.smooth))
+        self.log_denominators = np.zeros(len(self.classes))
+
+        # Define which terms had their counts changed since the probabilities were last calculated
+        self.dirty_terms = np.zeros(len(self.vocabulary), dtype=bool)
+        self.is_dirty = False
 
-        # Define the dictionaries for the conditional probabilities
-        self.conditionals_factual = {}
-        self.conditionals_not_factual = {}
+        # Define the (optional) cache of the scores of recently seen tweets
+        self.cache = None
     # end: __init__
 
-    def train(self, filename):
+    @property
+    def hashing(self):
+        """
+        The HashingVocabulary of this classifier, or None if it uses an exact vocabulary.
+        """
+        if isinstance(self.vocabulary, HashingVocabulary):
+            return self.vocabulary
+        # end: if
+        return None
+    # end: hashing
+
+    @property
+    def log_conditionals(self):
+        """
+        The conditional probabilities (stored as log base 10), as an array of shape (n_classes, vocabulary size).
         """
-        Train the Naive Bayes Classifier on the provided training set
-        :param filename: The filename of where to read the training data from.
+        self.update_probabilities()
+        return self.log_numerators - self.log_denominators[:, np.newaxis]
+    # end: log_conditionals
+
+    def train(self, source, workers=1, ignore_labels=(), fallback_encoding=FALLBACK_ENCODING):
+        """
+        Train the Naive Bayes Classifier on the provided training set, starting over from an empty model.
+        :param source: The filename of where to read the training data from, or an already loaded Corpus.
+        :param workers: The number of processes to use when reading the training data from a file.
+        :param ignore_labels: The labels of the tweets that should be left out of the training.
+        :param fallback_encoding: The encoding to use for the lines of the file that are not valid UTF-8.
         :return: void
         """
-        # Start reading the file
-        with open(filename, encoding="mbcs") as file:
-            # Setup a CSV reader to read the data line by line
-            reader = csv.reader(file, delimiter='\t')
+        # Forget about any previous training, so that training twice doesn't count the data twice
+        self.tweet_count = 0
+        self.class_counts[:] = 0
+        self.term_counts[:] = 0
+        self.dirty_terms[:] = True
+
+        # If we were given a filename, read it into a corpus first
+        if isinstance(source, str):
+            source = load_corpus(source, workers, self.tokenizer, (self.label_column,), self.hashing,
+                                 fallback_encoding)
+        # end: if
 
-            # The first line will contain the headers so we don't care about that
-            is_first_line = True
+        self.partial_fit(source, ignore_labels)
 
-            # Start reading each record in the dataset
-            for row in reader:
-                # Skip the first line
-                if is_first_line:
-                    is_first_line = False
-                    continue
-                # end: if
+        # Now that all of the training data has been counted, let's calculate the probabilities
+        self.update_probabilities()
+    # end: train
 
-                # Add this tweet to the correct count (factual or not)
-                # This property can be found on the 3rd element in the row
-                is_factual = False
-                if row[2].lower() == 'yes':
-                    self.factual_count += 1
-                    is_factual = True
-                else:
-                    self.not_factual_count += 1
-                # end: if
+    def partial_fit(self, batch, ignore_labels=()):
+        """
+        Update the model with a batch of new training data, on top of what it has already been trained on.
+        The probabilities are only recalculated when they are next needed, and only for the terms that changed.
+        :param batch: The new training data, either a Corpus (holding the label column of this classifier) or a list
+                      of (tweet_text, class) pairs.
+        :param ignore_labels: The labels of the tweets that should be left out of the training.
+        :return: void
+        """
+        # Count the pairs into a corpus first
+        if not isinstance(batch, Corpus):
+            corpus = Corpus(self.tokenizer, (self.label_column,), hashing=self.hashing)
+            for text, label in batch:
+                corpus.add(text, label.lower())
+            # end: for-loop
+            batch = corpus
+        # end: if
+        tweet_count, class_counts, term_counts = batch.get_counts(self.label_column, ignore_labels)
 
-                # Extract the tweet from this current record (it will be on the second index of the row)
-                tweet_text = row[1].lower()
+        # Go through each class of the corpus, adding its counts to the correct "bucket" (e.g. factual or not)
+        for label in sorted(class_counts):
+            class_index = self.get_class_index(label)
+            self.class_counts[class_index] += class_counts[label]
+
+            # Count each of the terms of this class
+            self.count_terms(term_counts[label], class_index)
+        # end: for-loop
 
-                # Count each of the terms in this tweet, using the correct "bucket" (factual or not)
-                self.count_terms(tweet_text, is_factual)
+        # Don't forget to increment the total tweet count
+        self.tweet_count += tweet_count
+        self.is_dirty = True
+    # end: partial_fit
 
-                # Don't forget to increment the total tweet count
-                self.tweet_count += 1
+    def merge(self, other):
+        """
+        Add the counts of another model (e.g. one trained on another part of the data) to this model.
+        Terms of the other model that are not part of this model's vocabulary are skipped.
+        :param other: The NaiveBayesClassifier to merge into this one.
+        :return: void
+        """
+        # Find where each of the other model's terms is in our vocabulary
+        # (hashing vocabularies with the same settings are equal, even if they are not the same object)
+        if other.vocabulary == self.vocabulary:
+            other_term_counts = other.term_counts
+        elif other.hashing is not None:
+            raise ValueError("A model using a hashing vocabulary can only be merged into one with the same settings")
+        else:
+            other_term_counts = np.zeros((len(other.classes), len(self.vocabulary)))
+            for other_id, term in enumerate(other.vocabulary):
+                term_id = self.vocabulary.get_id(term)
+                if term_id is not None:
+                    other_term_counts[:, term_id] += other.term_counts[:, other_id]
+                # end: if
             # end: for-loop
-        # end: with-file
+        # end: if-else
+
+        # Line up the other model's classes with ours
+        class_indices = [self.get_class_index(label) for label in other.classes]
+
+        # Add the counts, only the terms that were counted by the other model have changed
+        np.add.at(self.term_counts, class_indices, other_term_counts)
+        self.dirty_terms |= other_term_counts.any(axis=0)
+        np.add.at(self.class_counts, class_indices, other.class_counts)
+        self.tweet_count += other.tweet_count
+        self.is_dirty = True
+    # end: merge
+
+    def set_smooth(self, smooth):
+        """
+        Change the smoothing factor, without having to train the model again.
+        :param smooth: The new smoothing factor.
+        :return: void
+        """
+        self.smooth = smooth
+        self.dirty_terms[:] = True
+        self.is_dirty = True
+    # end: set_smooth
+
+    def update_probabilities(self):
+        """
+        Recalculate the probabilities that are out of date with the counts.
+        :return: void
+        """
+        if not self.is_dirty:
+            return
+        # end: if
 
-        # Now that all of the training data has been counted, let's calculate the probabilities
         # First calculate the PRIOR probabilities
-        self.prob_is_factual = self.factual_count / self.tweet_count
-        self.prob_is_not_factual = self.not_factual_count / self.tweet_count
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.log_priors = np.log10(self.class_counts / self.tweet_count)
+        # end: with
 
         # In order for our conditional calculations to work, we need to add the smoothing to the denominator as well
         # i.e. The total number of tokens in the particular class, plus the smoothed vocabulary size
-        smoothed_factual_count = self.factual_count + (len(self.vocabulary) * self.smooth)
-        smoothed_not_factual_count = self.not_factual_count + (len(self.vocabulary) * self.smooth)
+        self.log_denominators = np.log10(self.class_counts + (len(self.vocabulary) * self.smooth))
 
-        # Next let's calculate the conditional probabilities
-        # Start with the factual class
-        for term in self.factual_term_counts:
-            self.conditionals_factual[term] = self.factual_term_counts[term] / smoothed_factual_count
-        # end: for-loop
+        # Next let's calculate the numerators of the conditional probabilities, for the terms that changed only
+        term_ids = np.flatnonzero(self.dirty_terms)
+        self.log_numerators[:, term_ids] = np.log10(self.term_counts[:, term_ids] + self.smooth)
+        self.dirty_terms[:] = False
+        self.is_dirty = False
 
-        # Then do the not-factual class
-        for term in self.not_factual_term_counts:
-            self.conditionals_not_factual[term] = self.not_factual_term_counts[term] / smoothed_not_factual_count
-        # end: for-loop
-    # end: train
+        # The cached scores were calculated with the old probabilities
+        if self.cache is not None:
+            self.cache.clear()
+        # end: if
 
-    def test(self, filename):
+        # Keep track of how much memory the tables of this model use
+        METRICS.gauge("table_bytes:" + self.model_name, self.class_counts.nbytes + self.term_counts.nbytes +
+                      self.log_priors.nbytes + self.log_numerators.nbytes + self.log_denominators.nbytes)
+    # end: update_probabilities
+
+    def test(self, source, trace_format="text", evaluator=None, fallback_encoding=FALLBACK_ENCODING):
         """
         Test the classifier on the provided data.
         Note: the test-set does not contain a first row of headers, so we may start from the 1st row.
-        :param filename: The filename of the test set to use.
-        :return: void
+        :param source: The filename of the test set to use, or the test set already read as a list of batches of
+                       (tweet ids, tweet texts, [labels of this classifier's label column]).
+        :param trace_format: The format of the trace file, either "text" or "binary" (see TraceWriter).
+        :param evaluator: The StreamingEvaluator to feed the predictions to (a new one is created if not provided).
+        :param fallback_encoding: The encoding to use for the lines of the file that are not valid UTF-8.
+        :return: The StreamingEvaluator holding the metrics of the predictions.
         """
-        # Start reading the file
-        with open(filename, encoding="mbcs") as file:
-            # Setup a CSV reader to read the data line by line
-            reader = csv.reader(file, delimiter='\t')
-
-            # Start reading each record in the dataset
-            for row in reader:
-                # Extract the tweet-ID, which will be on the first index of the row
-                tweet_id = row[0]
-
-                # Extract the tweet text, which will be on the second index of the row
-                # Don't forget to lower case the text
-                tweet_text = row[1].lower()
-
-                # Also extract the TARGET class, which will be the value on the third index of the row
-                target_class = row[2].lower()
-
-                # Calculate the probabilities that this tweet belongs to the "factual" and "not factual" class
-                factual_score = self.get_probability(tweet_text, True)
-                not_factual_score = self.get_probability(tweet_text, False)
-
-                # Choose the max between the two probabilities
-                chosen_score = factual_score
-                chosen_class = "yes"
-                if not_factual_score > factual_score:
-                    chosen_score = not_factual_score
-                    chosen_class = "no"
-                # end: if
+        if evaluator is None:
+            evaluator = StreamingEvaluator(self.classes)
+        # end: if
+
+        # Binary traces are written next to the text ones, with a different extension
+        trace_file = self.output_file
+        if trace_format == "binary":
+            trace_file = os.path.splitext(trace_file)[0] + ".bin"
+        # end: if
 
-                # Write the output into the trace file for this tweet
-                self.write_trace(tweet_id, chosen_class, chosen_score, target_class)
+        # If we were given a filename, start reading the file in batches
+        if isinstance(source, str):
+            source = read_batches(source, BATCH_SIZE, label_columns=(self.label_column,),
+                                  fallback_encoding=fallback_encoding)
+        # end: if
+
+        # Keep the trace file open for the whole run
+        with TraceWriter(trace_file, trace_format) as trace:
+            for tweet_ids, texts, labels in source:
+                # Predict the classes of the whole batch
+                chosen_classes, chosen_scores = self.predict_batch(texts)
+
+                # Write the output into the trace file for the whole batch
+                target_classes = [label.lower() for label in labels[0]]
+                with METRICS.timer("trace_io"):
+                    trace.write_batch(tweet_ids, chosen_classes, chosen_scores, target_classes)
+                # end: with
+
+                # Keep the metrics up to date as we go
+                evaluator.update_batch(chosen_classes, target_classes)
             # end: for-loop
         # end: with-file
+
+        return evaluator
     # end: test
 
-    def write_trace(self, tweet_id, chosen_class, score, target_class):
+    def enable_cache(self, max_entries=MAX_ENTRIES):
         """
-        Write the output of this tweet into the trace file for this model.
-        :param tweet_id: The tweet ID.
-        :param chosen_class: The chosen (predicted) class for this tweet.
-        :param score: The calculated score of the tweet's chosen class.
-        :param target_class: The target (actual) class of the tweet.
-        :return: void
+        Cache the scores of the most recently seen tweets, so that repeated tweets (e.g. retweets) are only scored once.
+        The cache is cleared automatically whenever the model is updated.
+        :param max_entries: The maximum number of tweets to keep the scores of (None to stop caching).
+        :return: The PredictionCache, or None.
         """
-        # Define the line to be written in the trace file
-        # Each trace line should look like the following:
-        # tweet_id  chosen_class  score(in scientific-notation)  target_class  correct/wrong_label
-        line_to_write = tweet_id + "  " + chosen_class + "  " + "{:e}".format(score) + "  " + target_class + "  "
+        self.cache = None
+        if max_entries:
+            self.cache = PredictionCache(max_entries)
+        # end: if
+        return self.cache
+    # end: enable_cache
 
-        # Compare the target and chosen classes to see if this was a correct prediction or not
-        label = "correct"
-        if chosen_class != target_class:
-            label = "wrong"
+    def score_batch(self, texts):
+        """
+        Calculate the naive probabilities of a batch of tweets for every class.
+        :param texts: The list of tweet texts.
+        :return: The array of (log base 10) probabilities, of shape (n_tweets, n_classes).
+        """
+        if self.cache is not None:
+            return self.score_cached(tokenize_batch(self.tokenizer, texts))
         # end: if
 
-        # Append the label to the line_to_write
-        line_to_write += label
+        # Tokenize every tweet and build the sparse document-term matrix of the batch
+        return self.score_matrix(transform(self.vocabulary, self.tokenizer, texts))
+    # end: score_batch
 
-        # Create the file connection, append the line, and close the file connection
-        f = open(self.output_file, "a")
-        f.write(line_to_write + "\n")
-        f.close()
-    # end: write_trace
+    def score_cached(self, documents):
+        """
+        Calculate the naive probabilities of a batch of tokenized tweets, only scoring the ones that are not cached.
+        :param documents: The list of the tokens of each tweet.
+        :return: The array of (log base 10) probabilities, of shape (n_tweets, n_classes).
+        """
+        # Bring the probabilities up to date first, which clears the cache if the model has changed
+        self.update_probabilities()
+
+        # Look up every tweet, the tweets that are repeated within the batch itself are only scored once
+        scores = np.empty((len(documents), len(self.classes)))
+        missing = {}
+        for i, tokens in enumerate(documents):
+            key = self.cache.key(tokens)
+            if key in missing:
+                missing[key].append(i)
+                continue
+            # end: if
+            row = self.cache.get(key)
+            if row is None:
+                missing[key] = [i]
+            else:
+                scores[i] = row
+            # end: if-else
+        # end: for-loop
+
+        # Score the tweets that were not cached all together, and cache them
+        if missing:
+            rows = self.score_matrix(transform_documents(self.vocabulary,
+                                                         [documents[indices[0]] for indices in missing.values()]))
+            for (key, indices), row in zip(missing.items(), rows):
+                scores[indices] = row
+                self.cache.put(key, row.copy())
+            # end: for-loop
+        # end: if
+
+        return scores
+    # end: score_cached
+
+    def score_matrix(self, matrix):
+        """
+        Calculate the naive probabilities of an already built document-term matrix for every class.
+        :param matrix: The DocumentTermMatrix of the tweets (built with the vocabulary of this classifier).
+        :return: The array of (log base 10) probabilities, of shape (n_tweets, n_classes).
+        """
+        # Start with the PRIOR probabilities and add the logs of the conditional probabilities of every word
+        # (i.e. the log of the numerator of every word, minus the log of the denominator once per word)
+        self.update_probabilities()
+        with METRICS.timer("scoring"):
+            return (matrix.dot(self.log_numerators) - np.outer(matrix.row_sums(), self.log_denominators) +
+                    self.log_priors)
+        # end: with
+    # end: score_matrix
+
+    def predict_batch(self, texts):
+        """
+        Predict the classes of a batch of tweets.
+        :param texts: The list of tweet texts.
+        :return: The list of the chosen classes, and the array of the scores of the chosen classes.
+        """
+        return self.choose_classes(self.score_batch(texts))
+    # end: predict_batch
+
+    def choose_classes(self, scores):
+        """
+        Choose the class with the highest score for every tweet.
+        :param scores: The array of probabilities, of shape (n_tweets, n_classes).
+        :return: The list of the chosen classes, and the array of the scores of the chosen classes.
+        """
+        # Choose the max between the probabilities (ties go to the first class, i.e. "factual")
+        chosen_indices = scores.argmax(axis=1)
+        chosen_classes = [self.classes[i] for i in chosen_indices]
+        return chosen_classes, scores[np.arange(len(scores)), chosen_indices]
+    # end: choose_classes
+
+    def get_class_index(self, label):
+        """
+        Get the index of the class for the provided label.
+        With a fixed set of classes, any other label belongs to the last class (e.g. anything other than "yes" belongs
+        to the "not factual" class), otherwise the label is added as a new class.
+        :param label: The label (in lower case).
+        :return: The index of the class in the tables of this classifier.
+        """
+        class_index = self.class_indices.get(label)
+        if class_index is None:
+            if self.fixed_classes:
+                return len(self.classes) - 1
+            # end: if
+            class_index = self.add_class(label)
+        # end: if
+
+        return class_index
+    # end: get_class_index
+
+    def add_class(self, label):
+        """
+        Add a new class, with a new (empty) row in each of the tables.
+        :param label: The label of the class.
+        :return: The index of the new class.
+        """
+        class_index = len(self.classes)
+        self.class_indices[label] = class_index
+        self.classes.append(label)
+
+        self.class_counts = np.append(self.class_counts, 0)
+        self.term_counts = np.vstack([self.term_counts, np.zeros(len(self.vocabulary))])
+        self.log_priors = np.append(self.log_priors, 0)
+        self.log_numerators = np.vstack([self.log_numerators, np.full(len(self.vocabulary), np.log10(self.smooth))])
+        self.log_denominators = np.append(self.log_denominators, 0)
+        self.is_dirty = True
+        return class_index
+    # end: add_class
 
     def get_probability(self, text, target_is_factual):
         """
@@ -188,56 +450,213 @@ class NaiveBayesClassifier:
         :param target_is_factual: True if the target class we are checking for is the "factual" class, False otherwise.
         :return: The naive probability that this tweet belongs to the target class.
         """
-        # Start by making the probability be equal to the PRIOR probability for the specified target class
-        # We will be using log base 10 for the calculations
-        probability = math.log(self.prob_is_factual, 10)
+        # Choose the row of the tables to use for the target class
+        class_index = 0
         if not target_is_factual:
-            probability = math.log(self.prob_is_not_factual, 10)
-        # end: if
-
-        # Now, split the tweet text and loop through every token
-        tokens = text.split(' ')
-        for token in tokens:
-            # We are only interested in the terms that are part of our vocabulary
-            if token in self.vocabulary:
-                # Add the log of the conditional probability of this word from the appropriate dictionary
-                if target_is_factual:
-                    probability += math.log(self.conditionals_factual[token], 10)
-                else:
-                    probability += math.log(self.conditionals_not_factual[token], 10)
-                # end: if-else
-            # end: if
-        # end: for-loop
+            class_index = 1
+        # end: if
+
+        # Repeated tweets are looked up in the cache instead
+        if self.cache is not None:
+            return float(self.score_cached([self.tokenizer.tokenize(text)])[0, class_index])
+        # end: if
+
+        # Get the ids of the tokens, we are only interested in the terms that are part of our vocabulary
+        term_ids = self.vocabulary.get_ids(self.tokenizer.tokenize(text))
 
-        # Return the probability for the target class
-        return probability
+        # Start with the PRIOR probability for the specified target class and add the log of the conditional
+        # probability of every word (we are using log base 10 for the calculations)
+        self.update_probabilities()
+        return float(self.log_priors[class_index] + self.log_numerators[class_index, term_ids].sum() -
+                     len(term_ids) * self.log_denominators[class_index])
     # end: get_probability
 
-    def count_terms(self, text, is_factual):
+    def count_terms(self, term_counts, class_index):
         """
-        Get the term frequencies from the text, belonging to the provided "bucket" (factual or not)
-        :param text: The text to count.
-        :param is_factual: True if this text belongs in the "factual" bucket, False if it belongs in the other.
+        Add the term frequencies from the provided counts to the provided "bucket" (factual or not)
+        :param term_counts: The dictionary of terms and their counts.
+        :param class_index: The index of the class that these counts belong to.
         :return: void
         """
-        # First, split the text by the specified tokenizing delimiter (which is a space)
-        tokens = text.split(' ')
+        # Terms that are not in the vocabulary are simply skipped
+        counts = self.vocabulary.count_array(term_counts)
+        self.term_counts[class_index] += counts
+        self.dirty_terms |= counts > 0
+    # end: count_terms
+# end: class NaiveBayesClassifier
+
+
+def transform(vocabulary, tokenizer, texts):
+    """
+    Tokenize a batch of tweets and build their sparse document-term matrix.
+    :param vocabulary: The Vocabulary to use.
+    :param tokenizer: The Tokenizer to use.
+    :param texts: The list of tweet texts.
+    :return: The DocumentTermMatrix of the tweets.
+    """
+    return transform_documents(vocabulary, tokenize_batch(tokenizer, texts))
+# end: transform
+
+
+def tokenize_batch(tokenizer, texts):
+    """
+    Tokenize a batch of tweets.
+    :param tokenizer: The Tokenizer to use.
+    :param texts: The list of tweet texts.
+    :return: The list of the tokens of each tweet.
+    """
+    with METRICS.timer("tokenizing"):
+        return [tokenizer.tokenize(text) for text in texts]
+    # end: with
+# end: tokenize_batch
+
+
+def transform_documents(vocabulary, documents):
+    """
+    Build the sparse document-term matrix of a batch of tokenized tweets.
+    :param vocabulary: The Vocabulary to use.
+    :param documents: The list of the tokens of each tweet.
+    :return: The DocumentTermMatrix of the tweets.
+    """
+    matrix = vocabulary.transform(documents)
+
+    # Keep track of how many of the tokens are not part of the vocabulary
+    if METRICS.enabled:
+        token_count = sum(len(tokens) for tokens in documents)
+        METRICS.count("tokens_scored", token_count)
+        METRICS.count("tokens_out_of_vocabulary", token_count - len(matrix.indices))
+    # end: if
+
+    return matrix
+# end: transform_documents
+
+
+class MultiTargetNaiveBayes:
+    """
+    A set of Naive Bayes Classifiers, one per label column (target) of the Covid-19 tweet data, sharing the same
+    vocabulary and tokenizer. All of the targets are trained from a single pass over the training data, and each
+    batch of tweets is tokenized once and turned into a single document-term matrix that every target is scored on.
+    """
+
+    def __init__(self, vocabulary, model_name, tokenizer=None, label_columns=LABEL_COLUMNS, classes=None,
+                 ignore_labels=NOT_APPLICABLE):
+        """
+        Constructor for the MultiTargetNaiveBayes class.
+        :param vocabulary The vocabulary to use (either a Vocabulary, a HashingVocabulary or the dictionary from
+                          generate_vocabulary).
+        :param model_name The model name to use when generating the output files (the name of each target is added).
+        :param tokenizer The Tokenizer to use (by default, the text is lower cased and split on spaces).
+        :param label_columns The indices of the label columns in the records of the data sets.
+        :param classes The dictionary of {label column: classes} of the targets that have a fixed set of classes
+                       (by default, q1_label uses "yes" and "no" like a NaiveBayesClassifier, the others use the
+                       classes seen in training).
+        :param ignore_labels The labels of the tweets that should be left out of a target (in both training and
+                             testing).
+        """
+        if not isinstance(vocabulary, (Vocabulary, HashingVocabulary)):
+            vocabulary = Vocabulary(vocabulary)
+        # end: if
+        if classes is None:
+            classes = {2: CLASSES}
+        # end: if
+        self.vocabulary = vocabulary
+        self.label_columns = tuple(label_columns)
+        self.ignore_labels = ignore_labels
+
+        # Create one classifier per target, all sharing the same vocabulary (label columns start at q1_label)
+        self.classifiers = []
+        for column in self.label_columns:
+            self.classifiers.append(NaiveBayesClassifier(vocabulary, model_name + "-q" + repr(column - 1), tokenizer,
+                                                         classes.get(column), column))
+        # end: for-loop
+        self.tokenizer = self.classifiers[0].tokenizer
+    # end: __init__
 
-        # Choose which dictionary to use
-        dictionary_to_use = self.factual_term_counts
-        if not is_factual:
-            dictionary_to_use = self.not_factual_term_counts
+    def train(self, source, workers=1, fallback_encoding=FALLBACK_ENCODING):
+        """
+        Train the classifier of every target on the provided training set, starting over from empty models.
+        :param source: The filename of where to read the training data from, or an already loaded Corpus (holding all
+                       of the label columns of this model).
+        :param workers: The number of processes to use when reading the training data from a file.
+        :param fallback_encoding: The encoding to use for the lines of the file that are not valid UTF-8.
+        :return: void
+        """
+        # Read the file once for all of the targets
+        if isinstance(source, str):
+            source = load_corpus(source, workers, self.tokenizer, self.label_columns, self.classifiers[0].hashing,
+                                 fallback_encoding)
         # end: if
 
-        # Loop through each of the tokens
-        for token in tokens:
-            # Check if the term is in our vocabulary (i.e. is within the dictionary since the dictionaries
-            # are already initialized with the terms in the vocabulary)
-            # If the term is not in the vocabulary, we simply skip it
-            if token in dictionary_to_use:
-                # Add one to the count for this term
-                dictionary_to_use[token] += 1
+        for classifier in self.classifiers:
+            classifier.train(source, ignore_labels=self.ignore_labels)
+        # end: for-loop
+    # end: train
+
+    def score_batch(self, texts):
+        """
+        Calculate the naive probabilities of a batch of tweets for every class of every target.
+        :param texts: The list of tweet texts.
+        :return: The list of the arrays of (log base 10) probabilities of each target, of shape (n_tweets, n_classes).
+        """
+        # Tokenize every tweet and build the sparse document-term matrix of the batch once for all of the targets
+        matrix = transform(self.vocabulary, self.tokenizer, texts)
+        return [classifier.score_matrix(matrix) for classifier in self.classifiers]
+    # end: score_batch
+
+    def predict_batch(self, texts):
+        """
+        Predict the classes of a batch of tweets for every target.
+        :param texts: The list of tweet texts.
+        :return: The list of the (chosen classes, chosen scores) of each target.
+        """
+        scores = self.score_batch(texts)
+        return [classifier.choose_classes(scores[i]) for i, classifier in enumerate(self.classifiers)]
+    # end: predict_batch
+
+    def test(self, filename, trace_format="text", fallback_encoding=FALLBACK_ENCODING):
+        """
+        Test the classifier of every target on the provided data, writing one trace file per target.
+        The tweets whose label is ignored for a target are left out of that target's trace and metrics.
+        :param filename: The filename of the test set to use.
+        :param trace_format: The format of the trace files, either "text" or "binary" (see TraceWriter).
+        :param fallback_encoding: The encoding to use for the lines of the file that are not valid UTF-8.
+        :return: The list of the StreamingEvaluators holding the metrics of each target.
+        """
+        evaluators = [StreamingEvaluator(classifier.classes) for classifier in self.classifiers]
+
+        # Open the trace file of every target for the whole run
+        traces = []
+        for classifier in self.classifiers:
+            trace_file = classifier.output_file
+            if trace_format == "binary":
+                trace_file = os.path.splitext(trace_file)[0] + ".bin"
             # end: if
+            traces.append(TraceWriter(trace_file, trace_format))
         # end: for-loop
-    # end: count_terms
-# end: class NaiveBayesClassifier
+
+        try:
+            for tweet_ids, texts, labels in read_batches(filename, BATCH_SIZE, label_columns=self.label_columns,
+                                                         fallback_encoding=fallback_encoding):
+                predictions = self.predict_batch(texts)
+                for trace, evaluator, column, (chosen_classes, chosen_scores) in \
+                        zip(traces, evaluators, labels, predictions):
+                    # Only keep the tweets that this target applies to
+                    kept = [i for i, label in enumerate(column) if label.lower() not in self.ignore_labels]
+                    target_classes = [column[i].lower() for i in kept]
+                    chosen_classes = [chosen_classes[i] for i in kept]
+                    with METRICS.timer("trace_io"):
+                        trace.write_batch([tweet_ids[i] for i in kept], chosen_classes, chosen_scores[kept],
+                                          target_classes)
+                    # end: with
+                    evaluator.update_batch(chosen_classes, target_classes)
+                # end: for-loop
+            # end: for-loop
+        finally:
+            for trace in traces:
+                trace.close()
+            # end: for-loop
+        # end: try-finally
+
+        return evaluators
+    # end: test
+# end: class MultiTargetNaiveBayes
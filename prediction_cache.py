@@ -0,0 +1,101 @@
+import collections
+
+from instrumentation import METRICS
+
+# The default number of predictions kept in a cache
+MAX_ENTRIES = 100000
+
+
+class PredictionCache:
+    """
+    A bounded cache of the scores of recently seen tweets, evicting the least recently used ones first.
+    Tweets are keyed by a hash of their normalized token sequence (i.e. the output of the Tokenizer), so retweets and
+    copy-pasted tweets that only differ in case, URLs or mentions share a single entry.
+    The cache must be cleared whenever the model it belongs to changes (see NaiveBayesClassifier.enable_cache).
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        """
+        Constructor for the PredictionCache class.
+        :param max_entries: The maximum number of predictions to keep.
+        """
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+
+        # Define the statistics of the cache
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    # end: __init__
+
+    def __len__(self):
+        return len(self.entries)
+    # end: __len__
+
+    @staticmethod
+    def key(tokens):
+        """
+        Get the key of a tweet.
+        :param tokens: The list of the (normalized) tokens of the tweet.
+        :return: The key of the tweet in the cache.
+        """
+        return hash(tuple(tokens))
+    # end: key
+
+    def get(self, key):
+        """
+        Get the cached prediction of a tweet, marking it as the most recently used one.
+        :param key: The key of the tweet.
+        :return: The cached prediction, or None if it is not in the cache.
+        """
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            METRICS.count("cache_misses")
+            return None
+        # end: if
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        METRICS.count("cache_hits")
+        return value
+    # end: get
+
+    def put(self, key, value):
+        """
+        Add the prediction of a tweet to the cache, evicting the least recently used ones if it is full.
+        :param key: The key of the tweet.
+        :param value: The prediction.
+        :return: void
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        # end: while
+    # end: put
+
+    def clear(self):
+        """
+        Forget every cached prediction (e.g. when the model has been updated).
+        :return: void
+        """
+        if self.entries:
+            self.entries.clear()
+            self.invalidations += 1
+        # end: if
+    # end: clear
+
+    def stats(self):
+        """
+        Get the statistics of the cache.
+        :return: The dictionary of the statistics.
+        """
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries), "max_entries": self.max_entries, "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions, "invalidations": self.invalidations}
+    # end: stats
+# end: class PredictionCache
@@ -0,0 +1,442 @@
+import argparse
+import asyncio
+import collections
+import json
+import time
+
+import numpy as np
+
+from model_io import load_model
+
+# The maximum number of tweets scored together, and the maximum time (in seconds) a tweet waits for others to join it
+MAX_BATCH_SIZE = 256
+MAX_WAIT = 0.002
+
+# The number of the most recent request latencies that the percentiles are calculated over
+LATENCY_WINDOW = 10000
+
+# The largest request body accepted, in bytes
+MAX_BODY_SIZE = 1 << 24
+
+# The reason phrases of the HTTP status codes used by the server
+STATUS_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                  413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class MicroBatcher:
+    """
+    Combines the tweets of concurrent requests into micro-batches, so that they are scored together with a single
+    vectorized call of the classifier instead of one call per request.
+    A batch is scored as soon as it holds max_batch_size tweets, or when its first tweet has waited max_wait seconds.
+    """
+
+    def __init__(self, classifier, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT):
+        """
+        Constructor for the MicroBatcher class.
+        :param classifier: The trained NaiveBayesClassifier used to score the tweets.
+        :param max_batch_size: The maximum number of tweets in a batch.
+        :param max_wait: The maximum number of seconds the first tweet of a batch waits for others to join it.
+        """
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = None
+        self.task = None
+
+        # The number of batches scored and the number of tweets in them, to report the average batch size
+        self.batch_count = 0
+        self.tweet_count = 0
+    # end: __init__
+
+    def start(self):
+        """
+        Start scoring the batches (must be called from within the event loop).
+        :return: void
+        """
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+    # end: start
+
+    async def stop(self):
+        """
+        Stop scoring the batches.
+        :return: void
+        """
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        # end: try-except
+    # end: stop
+
+    async def score(self, texts):
+        """
+        Score a list of tweets, along with the tweets of the other requests waiting at the same time.
+        :param texts: The list of tweet texts.
+        :return: The list of the results of each tweet (see format_results).
+        """
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self.queue.put_nowait((text, future))
+            futures.append(future)
+        # end: for-loop
+
+        return await asyncio.gather(*futures)
+    # end: score
+
+    async def run(self):
+        """
+        Keep collecting the waiting tweets into batches and scoring them.
+        :return: void
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wait for the first tweet of the batch, then for the others until the batch is full or the time is up
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                # end: if
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                # end: if
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                # end: try-except
+            # end: while
+
+            # Score the batch in another thread, so the server keeps accepting requests in the meantime
+            texts = [text for text, _ in batch]
+            try:
+                results = await loop.run_in_executor(None, self.score_texts, texts)
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                    # end: if
+                # end: for-loop
+                continue
+            # end: try-except
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+                # end: if
+            # end: for-loop
+            self.batch_count += 1
+            self.tweet_count += len(batch)
+        # end: while
+    # end: run
+
+    def score_texts(self, texts):
+        """
+        Score a batch of tweets with the classifier.
+        :param texts: The list of tweet texts.
+        :return: The list of the results of each tweet.
+        """
+        scores = self.classifier.score_batch(texts)
+        chosen_classes, chosen_scores = self.classifier.choose_classes(scores)
+        return format_results(self.classifier.classes, scores, chosen_classes, chosen_scores)
+    # end: score_texts
+# end: class MicroBatcher
+
+
+class LatencyStats:
+    """
+    Keeps the latencies of the most recent requests to report their percentiles.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        """
+        Constructor for the LatencyStats class.
+        :param window: The number of the most recent latencies to keep.
+        """
+        self.latencies = collections.deque(maxlen=window)
+        self.request_count = 0
+    # end: __init__
+
+    def add(self, seconds):
+        """
+        Record the latency of a request.
+        :param seconds: The number of seconds it took to answer the request.
+        :return: void
+        """
+        self.latencies.append(seconds)
+        self.request_count += 1
+    # end: add
+
+    def percentiles(self, percents=(50, 90, 99, 99.9)):
+        """
+        Calculate the percentiles of the recent latencies.
+        :param percents: The percentiles to calculate.
+        :return: The dictionary of the latencies (in milliseconds) keyed by percentile, e.g. {"p50": 0.8, ...}.
+        """
+        if not self.latencies:
+            return {}
+        # end: if
+
+        values = np.percentile(np.fromiter(self.latencies, dtype=float), percents) * 1000
+        return {"p" + ("%g" % percent): float(value) for percent, value in zip(percents, values)}
+    # end: percentiles
+# end: class LatencyStats
+
+
+def format_results(classes, scores, chosen_classes, chosen_scores):
+    """
+    Turn the scores of a batch of tweets into JSON-serializable results.
+    :param classes: The list of the classes of the classifier.
+    :param scores: The array of the scores of every class, of shape (n_tweets, n_classes).
+    :param chosen_classes: The list of the chosen classes.
+    :param chosen_scores: The array of the scores of the chosen classes.
+    :return: The list of the results of each tweet, e.g. {"class": "yes", "score": -12.3, "scores": {...}}.
+    """
+    rows = scores.tolist()
+    return [{"class": chosen_class, "score": float(chosen_score), "scores": dict(zip(classes, row))}
+            for chosen_class, chosen_score, row in zip(chosen_classes, chosen_scores, rows)]
+# end: format_results
+
+
+class ScoringServer:
+    """
+    A local HTTP scoring service, listening on a TCP port or on a Unix socket, which loads a trained classifier once and
+    keeps it in memory. The endpoints are:
+    - POST /score: score {"text": "..."} (answered with a single result) or {"texts": [...]} (or a bare JSON array,
+      answered with the list of results).
+    - GET /stats: the latency percentiles of the recent requests and the average micro-batch size.
+    - GET /health: a simple liveness check.
+    """
+
+    def __init__(self, classifier, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT):
+        """
+        Constructor for the ScoringServer class.
+        :param classifier: The trained NaiveBayesClassifier used to score the tweets.
+        :param max_batch_size: The maximum number of tweets in a micro-batch.
+        :param max_wait: The maximum number of seconds a tweet waits for others to join its micro-batch.
+        """
+        self.classifier = classifier
+        self.batcher = MicroBatcher(classifier, max_batch_size, max_wait)
+        self.latency = LatencyStats()
+        self.server = None
+    # end: __init__
+
+    async def start(self, host="127.0.0.1", port=8080, unix_socket=None):
+        """
+        Start listening for requests.
+        :param host: The host to listen on.
+        :param port: The port to listen on (0 to pick a free one).
+        :param unix_socket: The path of the Unix socket to listen on instead of the host and port.
+        :return: void
+        """
+        self.batcher.start()
+        if unix_socket is not None:
+            self.server = await asyncio.start_unix_server(self.handle_connection, unix_socket)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host, port)
+        # end: if-else
+    # end: start
+
+    async def stop(self):
+        """
+        Stop listening for requests.
+        :return: void
+        """
+        self.server.close()
+        await self.server.wait_closed()
+        await self.batcher.stop()
+    # end: stop
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answer the requests of a connection until the client closes it.
+        :param reader: The stream reader of the connection.
+        :param writer: The stream writer of the connection.
+        :return: void
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                # end: if
+                start_time = time.perf_counter()
+
+                # Read the headers, then the body
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    # end: if
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                # end: while
+
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    await self.respond(writer, 400, {"error": "malformed request line"}, False)
+                    break
+                # end: if
+                method, path, version = parts
+                keep_alive = headers.get("connection", "").lower() != "close" and version != "HTTP/1.0"
+
+                # The rest of the connection can't be read without knowing where the body ends
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    length = -1
+                # end: try-except
+                if length < 0:
+                    await self.respond(writer, 400, {"error": "malformed Content-Length header"}, False)
+                    break
+                # end: if
+                if length > MAX_BODY_SIZE:
+                    await self.respond(writer, 413, {"error": "request body too large"}, False)
+                    break
+                # end: if
+                body = await reader.readexactly(length) if length else b""
+
+                # A failure while scoring is answered with an error, instead of dropping the connection
+                try:
+                    status, payload = await self.route(method, path.split("?")[0], body)
+                except Exception as error:
+                    status, payload = 500, {"error": "the request could not be scored: " + repr(error)}
+                # end: try-except
+                await self.respond(writer, status, payload, keep_alive)
+                if method == "POST" and status == 200:
+                    self.latency.add(time.perf_counter() - start_time)
+                # end: if
+                if not keep_alive:
+                    break
+                # end: if
+            # end: while
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+        # end: try-except-finally
+    # end: handle_connection
+
+    async def route(self, method, path, body):
+        """
+        Answer a request.
+        :param method: The HTTP method of the request.
+        :param path: The path of the request (without its query string).
+        :param body: The body of the request.
+        :return: The status code, and the JSON-serializable payload of the response.
+        """
+        if path == "/score":
+            if method != "POST":
+                return 405, {"error": "use POST to score tweets"}
+            # end: if
+            try:
+                request = json.loads(body.decode("utf-8"))
+            except ValueError:
+                return 400, {"error": "the body is not valid JSON"}
+            # end: try-except
+
+            # Accept a single tweet, an array of tweets, or an object holding either of them
+            if isinstance(request, dict) and isinstance(request.get("text"), str):
+                return 200, (await self.batcher.score([request["text"]]))[0]
+            # end: if
+            if isinstance(request, dict):
+                request = request.get("texts")
+            # end: if
+            if not isinstance(request, list) or not all(isinstance(text, str) for text in request):
+                return 400, {"error": "expected {\"text\": \"...\"}, {\"texts\": [...]} or an array of texts"}
+            # end: if
+            return 200, await self.batcher.score(request)
+        # end: if
+
+        if path == "/stats":
+            batch_count = self.batcher.batch_count
+            return 200, {
+                "model_name": self.classifier.model_name,
+                "requests": self.latency.request_count,
+                "tweets": self.batcher.tweet_count,
+                "batches": batch_count,
+                "average_batch_size": self.batcher.tweet_count / batch_count if batch_count else 0.0,
+                "latency_ms": self.latency.percentiles(),
+                "cache": self.classifier.cache.stats() if self.classifier.cache is not None else None,
+            }
+        # end: if
+
+        if path == "/health":
+            return 200, {"status": "ok"}
+        # end: if
+
+        return 404, {"error": "unknown path " + path}
+    # end: route
+
+    @staticmethod
+    async def respond(writer, status, payload, keep_alive):
+        """
+        Write a JSON response.
+        :param writer: The stream writer of the connection.
+        :param status: The status code.
+        :param payload: The JSON-serializable payload.
+        :param keep_alive: False to tell the client that the connection is closed after this response.
+        :return: void
+        """
+        body = json.dumps(payload).encode("utf-8")
+        head = ("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n" %
+                (status, STATUS_REASONS.get(status, ""), len(body), "keep-alive" if keep_alive else "close"))
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+    # end: respond
+# end: class ScoringServer
+
+
+async def serve(classifier, host="127.0.0.1", port=8080, unix_socket=None, max_batch_size=MAX_BATCH_SIZE,
+                max_wait=MAX_WAIT):
+    """
+    Run a scoring server until it is interrupted.
+    :param classifier: The trained NaiveBayesClassifier used to score the tweets.
+    :param host: The host to listen on.
+    :param port: The port to listen on.
+    :param unix_socket: The path of the Unix socket to listen on instead of the host and port.
+    :param max_batch_size: The maximum number of tweets in a micro-batch.
+    :param max_wait: The maximum number of seconds a tweet waits for others to join its micro-batch.
+    :return: void
+    """
+    server = ScoringServer(classifier, max_batch_size, max_wait)
+    await server.start(host, port, unix_socket)
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.stop()
+    # end: try-finally
+# end: serve
+
+
+if __name__ == '__main__':
+    """
+    Run the scoring server from the command line, e.g. python scoring_server.py outputs/NB-BOW-OV.model --port 8080
+    """
+    parser = argparse.ArgumentParser(description="Serve a trained model over HTTP, scoring tweets in micro-batches.")
+    parser.add_argument("model", help="model file written by model_io.save_model")
+    parser.add_argument("--host", default="127.0.0.1", help="host to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    parser.add_argument("--socket", help="Unix socket to listen on instead of the host and port")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH_SIZE, help="maximum number of tweets per batch")
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT * 1000,
+                        help="maximum time a tweet waits for others to join its batch, in milliseconds")
+    parser.add_argument("--cache", type=int, default=0, help="number of recent predictions to cache (0 to disable)")
+    arguments = parser.parse_args()
+
+    model = load_model(arguments.model)
+    model.enable_cache(arguments.cache)
+    try:
+        asyncio.run(serve(model, arguments.host, arguments.port, arguments.socket,
+                          arguments.max_batch, arguments.max_wait / 1000))
+    except KeyboardInterrupt:
+        pass
+    # end: try-except
+# end: __main__
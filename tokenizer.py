@@ -1,40 +1,28 @@
-import csv
+import re
+from collections import OrderedDict
 
+from tsv_reader import FALLBACK_ENCODING
 
-def generate_vocabulary(filename, filter_tokens=False):
+
+def generate_vocabulary(source, filter_tokens=False, tokenizer=None, fallback_encoding=FALLBACK_ENCODING):
     """
-    Tokenize all of the words in the provided file, building a dictionary with the unique tokens
+    Tokenize all of the words in the provided data, building a dictionary with the unique tokens
     (in lower case) as the keys and their term frequencies as the value.
-    :param filename The filename to use when reading in the data.
+    :param source The filename to use when reading in the data, or an already loaded Corpus.
     :param filter_tokens Will be true if the vocabulary should be filtered as per the assignment specifications.
+    :param tokenizer The Tokenizer to use when reading a file (by default, the text is split on spaces).
+    :param fallback_encoding The encoding to use for the lines of the file that are not valid UTF-8.
     :return: The dictionary of the terms and term frequencies.
     """
-    # Define the dictionary, empty by default
-    vocabulary = {}
-
-    # Start reading the file
-    with open(filename, encoding="mbcs") as file:
-        # Setup a CSV reader to read the data line by line
-        reader = csv.reader(file, delimiter='\t')
-
-        # The first line will contain the headers so we don't care about that
-        is_first_line = True
-
-        # Start reading each record in the dataset
-        for row in reader:
-            # Skip the first line
-            if is_first_line:
-                is_first_line = False
-                continue
-            # end: if
-
-            # Extract the tweet from this current record (it will be on the second index of the row)
-            tweet_text = row[1].lower()
+    # If we were given a filename, read it into a corpus first
+    # (imported here since the corpus module itself depends on this module)
+    if isinstance(source, str):
+        from corpus import load_corpus
+        source = load_corpus(source, tokenizer=tokenizer, fallback_encoding=fallback_encoding)
+    # end: if
 
-            # Tokenize this tweet and update the dictionary
-            tokenize(tweet_text, vocabulary)
-        # end: for-loop
-    # end: with-file
+    # Build the dictionary from the term frequencies of the corpus
+    vocabulary = source.term_frequencies()
 
     # If we must filter out all of the single-occurrence words
     terms_to_remove = []
@@ -57,28 +45,158 @@ def generate_vocabulary(filename, filter_tokens=False):
 # end: generate_vocabulary
 
 
-def tokenize(text, vocabulary):
+def tokenize(text, vocabulary, tokenizer=None):
     """
     Tokenize the text and record the terms key:value pairs in the provided dictionary.
     :param text: The text to tokenize.
     :param vocabulary The dictionary to add the terms to.
+    :param tokenizer The Tokenizer to use (by default, the text is split by the specified delimiter, which is a space).
     :return: void
     """
-    # First, split the text by the specified tokenizing delimiter (which is a space)
-    tokens = text.split(' ')
-
-    # Loop through each of the tokens
-    for token in tokens:
-        # Get the current term frequency for this token
-        frequency = 0
-        if token in vocabulary:
-            frequency = vocabulary[token]
-        # end: if
-
-        # Add one to the frequency
-        frequency += 1
+    if tokenizer is None:
+        tokenizer = DEFAULT_TOKENIZER
+    # end: if
 
-        # Set the frequency back for that token
-        vocabulary[token] = frequency
+    # Loop through each of the tokens, adding one to the frequency of each
+    for token in tokenizer.tokenize(text):
+        vocabulary[token] = vocabulary.get(token, 0) + 1
     # end: for-loop
 # end: tokenize
+
+
+class Tokenizer:
+    """
+    A tokenizer shared by every stage of the pipeline (vocabulary building, training and scoring), so that they all
+    agree on what the terms are (the tokens of each tweet are reused between the stages through the shared Corpus).
+    By default, the text is lower cased and split on spaces as per the assignment specifications. With normalize=True,
+    the text is instead matched against a single precompiled pattern which recognizes URLs, mentions, hashtags and
+    words, dropping the punctuation around them (and the empty tokens left by repeated spaces).
+    """
+
+    def __init__(self, lowercase=True, normalize=False, urls="replace", mentions="replace", hashtags="keep", ngrams=1,
+                 cache_size=0):
+        """
+        Constructor for the Tokenizer class.
+        :param lowercase: True if the text should be lower cased.
+        :param normalize: True to use the normalizing pattern instead of splitting on spaces.
+        :param urls: What to do with URLs when normalizing: "keep" them, "replace" them all with <url>, or "drop" them.
+        :param mentions: What to do with mentions when normalizing: "keep" them, "replace" them all with <user>, or
+                         "drop" them.
+        :param hashtags: What to do with hashtags when normalizing: "keep" them, "strip" the # from them, or "drop" them.
+        :param ngrams: The size of the largest n-grams to add to the tokens (1 for single terms only).
+        :param cache_size: The number of tokenized documents to keep (0 to disable the cache). The cache only pays off
+                           when the same texts are scored again and again (e.g. behind the scoring server), since the
+                           tweets of a training set are almost all different.
+        """
+        for name, value, choices in (("urls", urls, ("keep", "replace", "drop")),
+                                     ("mentions", mentions, ("keep", "replace", "drop")),
+                                     ("hashtags", hashtags, ("keep", "strip", "drop"))):
+            if value not in choices:
+                raise ValueError("Unknown " + name + " option: " + repr(value))
+            # end: if
+        # end: for-loop
+
+        self.lowercase = lowercase
+        self.normalize = normalize
+        self.urls = urls
+        self.mentions = mentions
+        self.hashtags = hashtags
+        self.ngrams = ngrams
+        self.cache_size = cache_size
+
+        # Define the cache of tokenized documents, as an ordered dictionary of {text: tokens}
+        self.cache = OrderedDict()
+    # end: __init__
+
+    def __getstate__(self):
+        # Don't send the cache along when the tokenizer is sent to another process
+        state = self.__dict__.copy()
+        state["cache"] = OrderedDict()
+        return state
+    # end: __getstate__
+
+    def config(self):
+        """
+        Get the options of this tokenizer (e.g. to save them along with a model).
+        :return: The dictionary of the options, which can be passed back to the constructor.
+        """
+        return {"lowercase": self.lowercase, "normalize": self.normalize, "urls": self.urls,
+                "mentions": self.mentions, "hashtags": self.hashtags, "ngrams": self.ngrams,
+                "cache_size": self.cache_size}
+    # end: config
+
+    def tokenize(self, text):
+        """
+        Tokenize the provided text, reusing the tokens of a previous call with the same text.
+        :param text: The text to tokenize.
+        :return: The list of tokens (which must not be modified, since it may be shared with other calls).
+        """
+        if self.cache_size <= 0:
+            return self.split(text)
+        # end: if
+
+        tokens = self.cache.get(text)
+        if tokens is None:
+            tokens = self.split(text)
+
+            # Make room in the cache by dropping the oldest document
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+            # end: if
+            self.cache[text] = tokens
+        # end: if
+
+        return tokens
+    # end: tokenize
+
+    def split(self, text):
+        """
+        Tokenize the provided text, without using the cache.
+        :param text: The text to tokenize.
+        :return: The list of tokens.
+        """
+        if self.lowercase:
+            text = text.lower()
+        # end: if
+
+        # Split the text by the specified tokenizing delimiter (which is a space)
+        if not self.normalize:
+            tokens = text.split(' ')
+        else:
+            tokens = []
+            for match in TOKEN_PATTERN.finditer(text):
+                kind = match.lastgroup
+                token = match.group()
+                if kind == "url":
+                    token = {"keep": token, "replace": "<url>", "drop": None}[self.urls]
+                elif kind == "mention":
+                    token = {"keep": token, "replace": "<user>", "drop": None}[self.mentions]
+                elif kind == "hashtag":
+                    token = {"keep": token, "strip": token[1:], "drop": None}[self.hashtags]
+                # end: if-elif
+
+                if token is not None:
+                    tokens.append(token)
+                # end: if
+            # end: for-loop
+        # end: if-else
+
+        # Add the n-grams (the terms are joined by a space, which can never be part of a single term)
+        for n in range(2, self.ngrams + 1):
+            tokens = tokens + [' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+        # end: for-loop
+
+        return tokens
+    # end: split
+# end: class Tokenizer
+
+
+# The pattern used by normalizing tokenizers: URLs, mentions, hashtags and words (which may contain inner apostrophes
+# and hyphens, e.g. don't or covid-19), anything else is punctuation or white space
+TOKEN_PATTERN = re.compile(r"(?P<url>https?://\S+|www\.\S+)"
+                           r"|(?P<mention>@\w+)"
+                           r"|(?P<hashtag>#\w+)"
+                           r"|(?P<word>\w+(?:['’-]\w+)*)")
+
+# The tokenizer used when none is provided, as per the assignment specifications
+DEFAULT_TOKENIZER = Tokenizer()
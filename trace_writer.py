@@ -0,0 +1,195 @@
+import json
+import struct
+
+import numpy as np
+
+# The magic bytes at the start of a binary trace file, followed by the offset of the footer
+BINARY_MAGIC = b"NBTRACE1"
+BINARY_HEADER = struct.Struct("<8sQ")
+
+# Every chunk of a binary trace file starts with the number of records it contains
+CHUNK_HEADER = struct.Struct("<I")
+
+# The size of the output buffer, in bytes
+BUFFER_SIZE = 1 << 20
+
+
+class TraceWriter:
+    """
+    A trace sink that stays open for a whole test run, writing the predictions in buffered batches.
+    Two formats are supported:
+    - "text": the original trace format, one line per tweet:
+      tweet_id  chosen_class  score(in scientific-notation)  target_class  correct/wrong_label
+    - "binary": a columnar format for very large runs, made up of one chunk per batch holding the tweet ids
+      (unsigned 64-bit), the scores (64-bit floats) and the chosen and target classes (16-bit indices into the
+      label table stored in the footer of the file). Use read_binary_trace to read it back.
+    """
+
+    def __init__(self, filename, trace_format="text"):
+        """
+        Constructor for the TraceWriter class.
+        :param filename: The filename of the trace file (new records are appended to it in text mode).
+        :param trace_format: The format of the trace file, either "text" or "binary".
+        """
+        if trace_format not in ("text", "binary"):
+            raise ValueError("Unknown trace format: " + repr(trace_format))
+        # end: if
+
+        self.filename = filename
+        self.trace_format = trace_format
+        self.record_count = 0
+
+        # Define the label table (and the index of each label) used by the binary format
+        self.labels = []
+        self.label_indices = {}
+
+        # Open the file once, binary traces start with the header (the footer offset is filled in on close)
+        if trace_format == "text":
+            self.file = open(filename, "a", encoding="utf-8", buffering=BUFFER_SIZE)
+        else:
+            self.file = open(filename, "wb", buffering=BUFFER_SIZE)
+            self.file.write(BINARY_HEADER.pack(BINARY_MAGIC, 0))
+        # end: if-else
+    # end: __init__
+
+    def __enter__(self):
+        return self
+    # end: __enter__
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    # end: __exit__
+
+    def write(self, tweet_id, chosen_class, score, target_class):
+        """
+        Write the output of a single tweet into the trace file.
+        :param tweet_id: The tweet ID.
+        :param chosen_class: The chosen (predicted) class for this tweet.
+        :param score: The calculated score of the tweet's chosen class.
+        :param target_class: The target (actual) class of the tweet.
+        :return: void
+        """
+        self.write_batch([tweet_id], [chosen_class], [score], [target_class])
+    # end: write
+
+    def write_batch(self, tweet_ids, chosen_classes, scores, target_classes):
+        """
+        Write the outputs of a batch of tweets into the trace file.
+        :param tweet_ids: The list of tweet IDs.
+        :param chosen_classes: The list of chosen (predicted) classes.
+        :param scores: The list of the calculated scores of the chosen classes.
+        :param target_classes: The list of target (actual) classes.
+        :return: void
+        """
+        if self.trace_format == "text":
+            self.write_text_batch(tweet_ids, chosen_classes, scores, target_classes)
+        else:
+            self.write_binary_batch(tweet_ids, chosen_classes, scores, target_classes)
+        # end: if-else
+
+        self.record_count += len(tweet_ids)
+    # end: write_batch
+
+    def write_text_batch(self, tweet_ids, chosen_classes, scores, target_classes):
+        """
+        Write a batch of trace lines, with a single write call for the whole batch.
+        :return: void
+        """
+        lines = []
+        for tweet_id, chosen_class, score, target_class in zip(tweet_ids, chosen_classes, scores, target_classes):
+            # Compare the target and chosen classes to see if this was a correct prediction or not
+            label = "correct"
+            if chosen_class != target_class:
+                label = "wrong"
+            # end: if
+
+            lines.append(tweet_id + "  " + chosen_class + "  " + "{:e}".format(score) + "  " + target_class + "  " +
+                         label + "\n")
+        # end: for-loop
+
+        self.file.write("".join(lines))
+    # end: write_text_batch
+
+    def write_binary_batch(self, tweet_ids, chosen_classes, scores, target_classes):
+        """
+        Write a batch of records as a single chunk of columns.
+        :return: void
+        """
+        self.file.write(CHUNK_HEADER.pack(len(tweet_ids)))
+        self.file.write(np.array([int(tweet_id) for tweet_id in tweet_ids], dtype="<u8").tobytes())
+        self.file.write(np.asarray(scores, dtype="<f8").tobytes())
+        self.file.write(np.array([self.get_label_index(c) for c in chosen_classes], dtype="<u2").tobytes())
+        self.file.write(np.array([self.get_label_index(c) for c in target_classes], dtype="<u2").tobytes())
+    # end: write_binary_batch
+
+    def get_label_index(self, label):
+        """
+        Get the index of a label in the label table, adding it to the table the first time it is seen.
+        :param label: The label.
+        :return: The index of the label.
+        """
+        index = self.label_indices.get(label)
+        if index is None:
+            index = len(self.labels)
+            self.label_indices[label] = index
+            self.labels.append(label)
+        # end: if
+
+        return index
+    # end: get_label_index
+
+    def close(self):
+        """
+        Flush and close the trace file. Binary traces get their footer (the label table) written here.
+        :return: void
+        """
+        if self.file.closed:
+            return
+        # end: if
+
+        if self.trace_format == "binary":
+            # Write the footer, then go back to the header to record where it starts
+            footer_offset = self.file.tell()
+            self.file.write(json.dumps({"labels": self.labels, "records": self.record_count}).encode("utf-8"))
+            self.file.seek(0)
+            self.file.write(BINARY_HEADER.pack(BINARY_MAGIC, footer_offset))
+        # end: if
+
+        self.file.close()
+    # end: close
+# end: class TraceWriter
+
+
+def read_binary_trace(filename):
+    """
+    Read back a trace file written in the "binary" format.
+    :param filename: The filename of the trace file.
+    :return: The label table, followed by the arrays of tweet ids, scores, chosen class indices and target class
+             indices (the indices refer to the label table).
+    """
+    with open(filename, "rb") as file:
+        data = file.read()
+    # end: with-file
+
+    magic, footer_offset = BINARY_HEADER.unpack_from(data, 0)
+    if magic != BINARY_MAGIC:
+        raise ValueError(filename + " is not a binary trace file")
+    # end: if
+    footer = json.loads(data[footer_offset:].decode("utf-8"))
+
+    # Read every chunk, each one made up of its columns one after the other
+    tweet_ids, scores, chosen, targets = [], [], [], []
+    offset = BINARY_HEADER.size
+    while offset < footer_offset:
+        (n,) = CHUNK_HEADER.unpack_from(data, offset)
+        offset += CHUNK_HEADER.size
+        for column, dtype in ((tweet_ids, "<u8"), (scores, "<f8"), (chosen, "<u2"), (targets, "<u2")):
+            column.append(np.frombuffer(data, dtype=dtype, count=n, offset=offset))
+            offset += n * np.dtype(dtype).itemsize
+        # end: for-loop
+    # end: while
+
+    return (footer["labels"], np.concatenate(tweet_ids or [np.zeros(0, "<u8")]),
+            np.concatenate(scores or [np.zeros(0, "<f8")]), np.concatenate(chosen or [np.zeros(0, "<u2")]),
+            np.concatenate(targets or [np.zeros(0, "<u2")]))
+# end: read_binary_trace
@@ -0,0 +1,196 @@
+import argparse
+import heapq
+import json
+
+import numpy as np
+
+from instrumentation import METRICS
+from model_io import load_model
+from naive_bayes_classifier import BATCH_SIZE
+from tsv_reader import read_batches
+
+# The default number of predictions kept per class
+TOP_K = 100
+
+
+class TopKTracker:
+    """
+    Keeps the k predictions with the highest margin of every class while streaming over the tweets, in a min-heap per
+    class, so that the memory used only depends on k and not on how many tweets there are.
+    """
+
+    def __init__(self, classes, k=TOP_K):
+        """
+        Constructor for the TopKTracker class.
+        :param classes: The list of the classes of the classifier.
+        :param k: The number of predictions to keep per class (0 to keep none, e.g. when only the tweets crossing a
+                  threshold are wanted).
+        """
+        if k < 0:
+            raise ValueError("The number of predictions to keep must not be negative: " + repr(k))
+        # end: if
+
+        self.classes = list(classes)
+        self.k = k
+
+        # Define the heap of each class, holding (margin, order seen, tweet id, tweet text) entries
+        self.heaps = [[] for _ in self.classes]
+        self.seen = 0
+    # end: __init__
+
+    def update_batch(self, tweet_ids, texts, chosen_indices, margins):
+        """
+        Add the predictions of a batch of tweets.
+        :param tweet_ids: The list of tweet IDs.
+        :param texts: The list of tweet texts.
+        :param chosen_indices: The array of the indices of the chosen classes.
+        :param margins: The array of the margins of the chosen classes (see get_margins).
+        :return: void
+        """
+        if self.k == 0:
+            self.seen += len(tweet_ids)
+            return
+        # end: if
+
+        for class_index, heap in enumerate(self.heaps):
+            rows = np.flatnonzero(chosen_indices == class_index)
+
+            # Only the k best tweets of the batch can make it into the heap, and only if they beat its smallest margin
+            if len(rows) > self.k:
+                rows = rows[np.argsort(-margins[rows], kind="stable")[:self.k]]
+            # end: if
+            if len(heap) == self.k:
+                rows = rows[margins[rows] > heap[0][0]]
+            # end: if
+
+            # The tweets seen first win the ties
+            for i in rows:
+                entry = (float(margins[i]), -(self.seen + int(i)), tweet_ids[i], texts[i])
+                if len(heap) < self.k:
+                    heapq.heappush(heap, entry)
+                else:
+                    heapq.heappushpop(heap, entry)
+                # end: if-else
+            # end: for-loop
+        # end: for-loop
+
+        self.seen += len(tweet_ids)
+    # end: update_batch
+
+    def results(self):
+        """
+        Get the top-k predictions of every class.
+        :return: The dictionary of {class: list of predictions}, each list being sorted from the highest margin down.
+        """
+        return {label: [{"tweet_id": tweet_id, "margin": margin, "text": text}
+                        for margin, _, tweet_id, text in sorted(heap, reverse=True)]
+                for label, heap in zip(self.classes, self.heaps)}
+    # end: results
+# end: class TopKTracker
+
+
+def get_margins(scores):
+    """
+    Choose the class with the highest score for every tweet, along with its margin over the runner-up class.
+    Since the scores are log probabilities, the margin is the log-odds (base 10) of the chosen class against the
+    runner-up, e.g. a margin of 2 means the chosen class is 100 times more likely.
+    :param scores: The array of probabilities, of shape (n_tweets, n_classes).
+    :return: The array of the indices of the chosen classes, and the array of their margins.
+    """
+    chosen_indices = scores.argmax(axis=1)
+    rows = np.arange(len(scores))
+    if scores.shape[1] < 2:
+        return chosen_indices, np.zeros(len(scores))
+    # end: if
+
+    runner_up = scores.copy()
+    runner_up[rows, chosen_indices] = -np.inf
+    return chosen_indices, scores[rows, chosen_indices] - runner_up.max(axis=1)
+# end: get_margins
+
+
+def triage(model, filename, k=TOP_K, threshold=None, threshold_classes=None, output_file=None, has_headers=False):
+    """
+    Stream over a file of tweets, keeping the top-k predictions of every class by margin, and writing out only the
+    tweets whose margin crosses the threshold. No trace is written, and the memory used does not depend on the size
+    of the file.
+    :param model: The trained NaiveBayesClassifier (or CompactClassifier).
+    :param filename: The filename of the tweets to score (the label columns, if any, are not used).
+    :param k: The number of predictions to keep per class.
+    :param threshold: The smallest margin of the tweets to write out (None to not write any).
+    :param threshold_classes: The classes of the tweets to write out (None for every class), e.g. ["no"] to only write
+                              out the tweets confidently predicted as not factual.
+    :param output_file: The filename of the TSV file to write the tweets crossing the threshold to.
+    :param has_headers: True if the first line of the file contains the headers (which are skipped).
+    :return: The dictionary of the number of tweets scored, the number of tweets crossing the threshold and the top-k
+             predictions of every class.
+    """
+    tracker = TopKTracker(model.classes, k)
+    flagged_indices = np.arange(len(model.classes))
+    if threshold_classes is not None:
+        flagged_indices = [model.classes.index(label) for label in threshold_classes]
+    # end: if
+
+    output = None
+    if threshold is not None and output_file is not None:
+        output = open(output_file, "w", encoding="utf-8", newline="\n")
+        output.write("tweet_id\tclass\tmargin\ttext\n")
+    # end: if
+
+    tweet_count = 0
+    flagged_count = 0
+    try:
+        for tweet_ids, texts, _ in read_batches(filename, BATCH_SIZE, has_headers, ()):
+            chosen_indices, margins = get_margins(model.score_batch(texts))
+            with METRICS.timer("triage"):
+                tracker.update_batch(tweet_ids, texts, chosen_indices, margins)
+
+                # Write out the tweets crossing the threshold
+                if threshold is not None:
+                    rows = np.flatnonzero((margins >= threshold) & np.isin(chosen_indices, flagged_indices))
+                    flagged_count += len(rows)
+                    if output is not None:
+                        output.write("".join(tweet_ids[i] + "\t" + model.classes[chosen_indices[i]] + "\t" +
+                                             "{:e}".format(margins[i]) + "\t" + texts[i] + "\n" for i in rows))
+                    # end: if
+                # end: if
+            # end: with
+            tweet_count += len(tweet_ids)
+        # end: for-loop
+    finally:
+        if output is not None:
+            output.close()
+        # end: if
+    # end: try-finally
+
+    return {"tweets": tweet_count, "threshold": threshold, "flagged": flagged_count, "top_k": tracker.results()}
+# end: triage
+
+
+if __name__ == '__main__':
+    """
+    Triage a file of tweets from the command line, e.g.
+    python triage.py outputs/NB-BOW-OV.model tweets.tsv --top-k 50 --threshold 2 --class no --output flagged.tsv
+    """
+    parser = argparse.ArgumentParser(description="Keep the most confident predictions of a large file of tweets.")
+    parser.add_argument("model", help="model file written by model_io.save_model")
+    parser.add_argument("tweets", help="file of tweets to score (tweet_id, text, ...)")
+    parser.add_argument("--headers", action="store_true", help="the first line of the file contains the headers")
+    parser.add_argument("--top-k", type=int, default=TOP_K,
+                        help="number of predictions to keep per class (0 to only write out the threshold crossings)")
+    parser.add_argument("--threshold", type=float, help="smallest margin (log10 odds) of the tweets to write out")
+    parser.add_argument("--class", dest="classes", nargs="+", help="only write out the tweets of these classes")
+    parser.add_argument("--output", help="TSV file to write the tweets crossing the threshold to")
+    parser.add_argument("--report", help="file to write the top-k predictions to, as JSON")
+    arguments = parser.parse_args()
+
+    triage_results = triage(load_model(arguments.model), arguments.tweets, arguments.top_k, arguments.threshold,
+                            arguments.classes, arguments.output, arguments.headers)
+    print("Scored %d tweets, %d crossed the threshold" % (triage_results["tweets"], triage_results["flagged"]))
+
+    if arguments.report:
+        with open(arguments.report, "w", encoding="utf-8") as report:
+            json.dump(triage_results, report, indent=2, ensure_ascii=False)
+        # end: with-file
+    # end: if
+# end: __main__
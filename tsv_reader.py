@@ -0,0 +1,253 @@
+import gzip
+
+try:
+    import zstandard
+except ImportError:
+    # zstd-compressed data sets can only be read when the zstandard package is installed
+    zstandard = None
+# end: try-except
+
+from instrumentation import METRICS
+
+# The encoding of the data sets, and the encoding used for the lines that are not valid in it
+ENCODING = "utf-8"
+FALLBACK_ENCODING = "cp1252"
+
+# The number of bytes read from the file at once (and at once while looking for the end of the headers)
+CHUNK_SIZE = 1 << 22
+HEADER_BLOCK_SIZE = 1 << 12
+
+# The magic bytes at the start of compressed files
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def is_compressed(filename):
+    """
+    Check if the provided file is compressed (with gzip or zstd).
+    :param filename: The filename of the data set.
+    :return: True if the file is compressed.
+    """
+    with open(filename, "rb") as file:
+        magic = file.read(4)
+    # end: with-file
+
+    return magic.startswith(GZIP_MAGIC) or magic.startswith(ZSTD_MAGIC)
+# end: is_compressed
+
+
+def open_binary(filename):
+    """
+    Open the provided data set for reading in binary mode, decompressing it transparently if needed.
+    :param filename: The filename of the data set.
+    :return: The binary file object.
+    """
+    with open(filename, "rb") as file:
+        magic = file.read(4)
+    # end: with-file
+
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(filename, "rb")
+    # end: if
+    if magic.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ImportError("The zstandard package is required to read " + filename)
+        # end: if
+        return zstandard.ZstdDecompressor().stream_reader(open(filename, "rb"), closefd=True)
+    # end: if
+
+    return open(filename, "rb")
+# end: open_binary
+
+
+def decode(data, encoding=ENCODING, fallback_encoding=FALLBACK_ENCODING):
+    """
+    Decode a chunk of complete lines, falling back to the other encoding for the lines that are not valid.
+    :param data: The bytes to decode.
+    :param encoding: The encoding of the data.
+    :param fallback_encoding: The encoding to use for the lines that are not valid in the encoding (None to raise).
+    :return: The decoded text.
+    """
+    try:
+        return data.decode(encoding)
+    except UnicodeDecodeError:
+        if fallback_encoding is None:
+            raise
+        # end: if
+    # end: try-except
+
+    # Only the lines that are not valid are decoded with the fallback encoding
+    lines = []
+    for line in data.split(b"\n"):
+        try:
+            lines.append(line.decode(encoding))
+        except UnicodeDecodeError:
+            lines.append(line.decode(fallback_encoding, errors="replace"))
+        # end: try-except
+    # end: for-loop
+
+    return "\n".join(lines)
+# end: decode
+
+
+def read_chunks(filename, start=0, end=None, encoding=ENCODING, fallback_encoding=FALLBACK_ENCODING):
+    """
+    Read the provided data set in large chunks of complete, decoded lines.
+    When a byte range is provided, only the lines that start within [start, end) are read, so that the ranges of a file
+    can be read by different processes (which is not possible for compressed files).
+    :param filename: The filename of the data set.
+    :param start: The offset of the first byte of the range.
+    :param end: The offset of the first byte after the range (None for the end of the file).
+    :param encoding: The encoding of the data.
+    :param fallback_encoding: The encoding to use for the lines that are not valid in the encoding.
+    :return: The generator of decoded chunks, each one made up of complete lines.
+    """
+    with open_binary(filename) as file:
+        # A line belongs to the range that it starts in, so skip the end of the line that started before this range
+        position = 0
+        if start > 0:
+            file.seek(start - 1)
+            position = start + len(file.readline()) - 1
+        # end: if
+
+        remainder = b""
+        while end is None or position < end:
+            size = CHUNK_SIZE
+            if end is not None:
+                size = min(size, end - position)
+            # end: if
+            data = file.read(size)
+            if not data:
+                break
+            # end: if
+            position += len(data)
+
+            # Finish the last line of the range, which may go past its end
+            if end is not None and position >= end and not data.endswith(b"\n"):
+                data += file.readline()
+            # end: if
+
+            # Keep the incomplete line at the end of the chunk for the next one
+            data = remainder + data
+            cut = data.rfind(b"\n") + 1
+            remainder = data[cut:]
+            if cut > 0:
+                yield decode(data[:cut], encoding, fallback_encoding)
+            # end: if
+        # end: while
+
+        if remainder:
+            yield decode(remainder, encoding, fallback_encoding)
+        # end: if
+    # end: with-file
+# end: read_chunks
+
+
+def split_record(line):
+    """
+    Split a line into its fields, removing the quotes around the quoted fields (in which "" stands for ").
+    :param line: The line (without its line break).
+    :return: The list of fields.
+    """
+    fields = line.split("\t")
+    for i, field in enumerate(fields):
+        if field[:1] == '"' and field[-1:] == '"' and len(field) > 1:
+            fields[i] = field[1:-1].replace('""', '"')
+        # end: if
+    # end: for-loop
+
+    return fields
+# end: split_record
+
+
+def read_headers(filename, encoding=ENCODING, fallback_encoding=FALLBACK_ENCODING):
+    """
+    Read the headers on the first line of the provided data set.
+    :param filename: The filename of the data set.
+    :param encoding: The encoding of the data.
+    :param fallback_encoding: The encoding to use if the line is not valid in the encoding.
+    :return: The list of headers.
+    """
+    # The stream readers of compressed files don't all support readline, so read the first line in blocks instead
+    line = b""
+    with open_binary(filename) as file:
+        while b"\n" not in line:
+            data = file.read(HEADER_BLOCK_SIZE)
+            if not data:
+                break
+            # end: if
+            line += data
+        # end: while
+    # end: with-file
+    line = line.split(b"\n", 1)[0]
+
+    return split_record(decode(line, encoding, fallback_encoding).rstrip("\r\n"))
+# end: read_headers
+
+
+def read_batches(filename, batch_size, has_headers=False, label_columns=(2,), start=0, end=None, encoding=ENCODING,
+                 fallback_encoding=FALLBACK_ENCODING):
+    """
+    Read the records of the provided data set in batches of columns.
+    The file is read in large chunks which are split on line breaks and tabs directly, which is much faster than going
+    through a CSV reader row by row. This relies on every record being on a single line, which is the case for the
+    tweet datasets. Compressed files (gzip or zstd) are decompressed transparently.
+    :param filename: The filename of the data set.
+    :param batch_size: The number of records in each batch.
+    :param has_headers: True if the first line contains the headers (which are skipped).
+    :param label_columns: The indices of the label columns to read.
+    :param start: The offset of the first byte of the range to read (see read_chunks).
+    :param end: The offset of the first byte after the range to read (None for the end of the file).
+    :param encoding: The encoding of the data.
+    :param fallback_encoding: The encoding to use for the lines that are not valid in the encoding.
+    :return: The generator of batches, each one being the list of tweet ids, the list of tweet texts and the list of
+             the label columns (each one being the list of labels of the batch).
+    """
+    skip_headers = has_headers and start == 0
+    rows = []
+    for chunk in read_chunks(filename, start, end, encoding, fallback_encoding):
+        with METRICS.timer("csv_parsing"):
+            lines = chunk.split("\n")
+            if skip_headers:
+                lines = lines[1:]
+                skip_headers = False
+            # end: if
+
+            for line in lines:
+                if line.endswith("\r"):
+                    line = line[:-1]
+                # end: if
+                if line:
+                    rows.append(split_record(line))
+                # end: if
+            # end: for-loop
+        # end: with
+
+        # Send out all of the complete batches, keeping the rest for the next chunk
+        complete = len(rows) - len(rows) % batch_size
+        for i in range(0, complete, batch_size):
+            yield make_batch(rows[i:i + batch_size], label_columns)
+        # end: for-loop
+        rows = rows[complete:]
+    # end: for-loop
+
+    if rows:
+        yield make_batch(rows, label_columns)
+    # end: if
+# end: read_batches
+
+
+def make_batch(rows, label_columns):
+    """
+    Turn a list of records into columns.
+    :param rows: The list of records, each one being the list of its fields.
+    :param label_columns: The indices of the label columns.
+    :return: The list of tweet ids, the list of tweet texts and the list of the label columns.
+    """
+    METRICS.count("rows_parsed", len(rows))
+    ids = [row[0] for row in rows]
+    texts = [row[1] if len(row) > 1 else "" for row in rows]
+    labels = [[row[column] if len(row) > column else "" for row in rows] for column in label_columns]
+    return ids, texts, labels
+# end: make_batch
+
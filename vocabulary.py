@@ -0,0 +1,435 @@
+import hashlib
+import zlib
+
+import numpy as np
+
+# The default number of buckets of a HashingVocabulary
+HASH_BUCKETS = 1 << 18
+
+
+class Vocabulary:
+    """
+    A vocabulary that maps each term to an integer id, so that the tables of a model can be stored as arrays
+    indexed by that id instead of as dictionaries keyed by the term.
+    """
+
+    def __init__(self, terms=()):
+        """
+        Constructor for the Vocabulary class.
+        :param terms: The terms to add to the vocabulary (i.e. the keys of the dictionary from generate_vocabulary).
+        """
+        # Define the list of terms (indexed by id) and the dictionary mapping each term back to its id
+        self.terms = []
+        self.ids = {}
+
+        # Add each of the provided terms, in order
+        for term in terms:
+            self.add(term)
+        # end: for-loop
+    # end: __init__
+
+    def __len__(self):
+        return len(self.terms)
+    # end: __len__
+
+    def __contains__(self, term):
+        return term in self.ids
+    # end: __contains__
+
+    def __iter__(self):
+        return iter(self.terms)
+    # end: __iter__
+
+    def add(self, term):
+        """
+        Add a term to the vocabulary if it is not already part of it.
+        :param term: The term to add.
+        :return: The id of the term.
+        """
+        term_id = self.ids.get(term)
+        if term_id is None:
+            term_id = len(self.terms)
+            self.ids[term] = term_id
+            self.terms.append(term)
+        # end: if
+
+        return term_id
+    # end: add
+
+    def get_id(self, term):
+        """
+        Get the id of a term.
+        :param term: The term to look up.
+        :return: The id of the term, or None if it is not part of the vocabulary.
+        """
+        return self.ids.get(term)
+    # end: get_id
+
+    def get_id_table(self, terms):
+        """
+        Get the dictionary to look the provided terms up in.
+        :param terms: The terms that will be looked up.
+        :return: The dictionary of {term: id}, any term missing from it is not part of the vocabulary.
+        """
+        return self.ids
+    # end: get_id_table
+
+    def get_ids(self, tokens):
+        """
+        Get the ids of the provided tokens, skipping the ones that are not part of the vocabulary.
+        :param tokens: The tokens to look up.
+        :return: The array of term ids.
+        """
+        ids = self.get_id_table(tokens)
+        return np.fromiter((ids[token] for token in tokens if token in ids), dtype=np.int64)
+    # end: get_ids
+
+    def transform(self, documents):
+        """
+        Convert a batch of tokenized documents into a sparse document-term matrix.
+        Tokens that are not part of the vocabulary are skipped, and repeated tokens are stored as repeated entries
+        (which are summed up by the matrix operations).
+        :param documents: The list of documents, each one being a list of tokens.
+        :return: The DocumentTermMatrix of the documents.
+        """
+        ids = self.get_id_table(token for tokens in documents for token in tokens)
+
+        # Look up the ids of every document, keeping track of where each document starts
+        indptr = np.zeros(len(documents) + 1, dtype=np.int64)
+        indices = []
+        for i, tokens in enumerate(documents):
+            indices.extend(ids[token] for token in tokens if token in ids)
+            indptr[i + 1] = len(indices)
+        # end: for-loop
+
+        indices = np.array(indices, dtype=np.int64)
+        return DocumentTermMatrix(indptr, indices, np.ones(len(indices)), len(self.terms))
+    # end: transform
+
+    def count_array(self, term_counts):
+        """
+        Convert a dictionary of term counts into a dense array indexed by term id.
+        Terms that are not part of the vocabulary are skipped.
+        :param term_counts: The dictionary of terms and their counts.
+        :return: The array of counts, of the same length as the vocabulary.
+        """
+        counts = np.zeros(len(self.terms))
+        ids = self.get_id_table(term_counts)
+        for term, count in term_counts.items():
+            term_id = ids.get(term)
+            if term_id is not None:
+                counts[term_id] += count
+            # end: if
+        # end: for-loop
+
+        return counts
+    # end: count_array
+# end: class Vocabulary
+
+
+class MappedVocabulary(Vocabulary):
+    """
+    A read-only Vocabulary used straight from the arrays of a model file (see model_io.load_model): the string table of
+    the terms, and the table of the hashes of the terms sorted along with their ids.
+    Nothing is built when the model is loaded, so every process loading the same file shares these arrays instead of
+    holding its own dictionary of every term. The terms are looked up with a binary search of their hashes, and are
+    then checked against the string table, so two terms sharing a hash are still told apart.
+    """
+
+    def __init__(self, term_offsets, term_bytes, term_hashes, hash_ids):
+        """
+        Constructor for the MappedVocabulary class.
+        :param term_offsets: The array of the offsets of each term in the string table (plus the end of the last one).
+        :param term_bytes: The array of the UTF-8 encoded terms, one after the other.
+        :param term_hashes: The sorted array of the hashes of the terms (see hash_terms).
+        :param hash_ids: The array of the id of the term of each hash.
+        """
+        self.terms = MappedTerms(term_offsets, term_bytes)
+        self.term_hashes = term_hashes
+        self.hash_ids = hash_ids
+    # end: __init__
+
+    def __contains__(self, term):
+        return self.get_id(term) is not None
+    # end: __contains__
+
+    def add(self, term):
+        """
+        The terms of a mapped vocabulary can't be changed.
+        """
+        raise ValueError("A vocabulary loaded from a model file is read-only")
+    # end: add
+
+    def get_id(self, term):
+        """
+        Get the id of a term.
+        :param term: The term to look up.
+        :return: The id of the term, or None if it is not part of the vocabulary.
+        """
+        return self.get_id_table((term,)).get(term)
+    # end: get_id
+
+    def get_id_table(self, terms):
+        """
+        Look up the provided terms, all at once.
+        :param terms: The terms that will be looked up.
+        :return: The dictionary of {term: id} of the terms that are part of the vocabulary.
+        """
+        terms = list(dict.fromkeys(terms))
+        encoded_terms = [term.encode("utf-8") for term in terms]
+        hashes = hash_terms(encoded_terms)
+        positions = np.searchsorted(self.term_hashes, hashes).tolist()
+
+        table = {}
+        term_hashes = self.term_hashes
+        for term, encoded_term, term_hash, position in zip(terms, encoded_terms, hashes.tolist(), positions):
+            # Check every term with the same hash (almost always a single one, if any)
+            while position < len(term_hashes) and int(term_hashes[position]) == term_hash:
+                term_id = int(self.hash_ids[position])
+                if self.terms.get_bytes(term_id) == encoded_term:
+                    table[term] = term_id
+                    break
+                # end: if
+                position += 1
+            # end: while
+        # end: for-loop
+
+        return table
+    # end: get_id_table
+# end: class MappedVocabulary
+
+
+class MappedTerms:
+    """
+    The list of the terms of a MappedVocabulary, decoded from its string table when they are accessed.
+    """
+
+    def __init__(self, term_offsets, term_bytes):
+        """
+        Constructor for the MappedTerms class.
+        :param term_offsets: The array of the offsets of each term in the string table (plus the end of the last one).
+        :param term_bytes: The array of the UTF-8 encoded terms, one after the other.
+        """
+        self.term_offsets = term_offsets
+        self.term_bytes = term_bytes
+    # end: __init__
+
+    def __len__(self):
+        return len(self.term_offsets) - 1
+    # end: __len__
+
+    def __getitem__(self, term_id):
+        if not -len(self) <= term_id < len(self):
+            raise IndexError("term id out of range")
+        # end: if
+        return self.get_bytes(term_id % len(self)).decode("utf-8")
+    # end: __getitem__
+
+    def __iter__(self):
+        for term_id in range(len(self)):
+            yield self.get_bytes(term_id).decode("utf-8")
+        # end: for-loop
+    # end: __iter__
+
+    def get_bytes(self, term_id):
+        """
+        Get the UTF-8 encoded term of an id.
+        :param term_id: The id of the term.
+        :return: The bytes of the term.
+        """
+        return self.term_bytes[self.term_offsets[term_id]:self.term_offsets[term_id + 1]].tobytes()
+    # end: get_bytes
+# end: class MappedTerms
+
+
+def hash_terms(encoded_terms):
+    """
+    Get the 64-bit hashes of the provided terms, which are the same in every process (unlike the built-in hash of a
+    string), so that they can be stored in a model file.
+    :param encoded_terms: The list of UTF-8 encoded terms.
+    :return: The array of hashes.
+    """
+    blake2b = hashlib.blake2b
+    return np.fromiter((int.from_bytes(blake2b(term, digest_size=8).digest(), "little") for term in encoded_terms),
+                       dtype=np.uint64, count=len(encoded_terms))
+# end: hash_terms
+
+
+class HashingVocabulary:
+    """
+    A vocabulary of a fixed number of buckets, which maps each term to an id by hashing it (the hashing trick).
+    There is no vocabulary to build before training and every term has an id, so new terms (e.g. new hashtags) count
+    and score straight away, and the tables of a model stay the same size no matter how many distinct terms are seen.
+    The price is that the terms that share a bucket also share their counts.
+    """
+
+    def __init__(self, buckets=HASH_BUCKETS, seed=0):
+        """
+        Constructor for the HashingVocabulary class.
+        :param buckets: The number of buckets (i.e. the number of term ids).
+        :param seed: The seed of the hash function, models can only be merged if they use the same seed.
+        """
+        self.buckets = buckets
+        self.seed = seed
+    # end: __init__
+
+    def __len__(self):
+        return self.buckets
+    # end: __len__
+
+    def __contains__(self, term):
+        return True
+    # end: __contains__
+
+    def __eq__(self, other):
+        return isinstance(other, HashingVocabulary) and self.config() == other.config()
+    # end: __eq__
+
+    def __hash__(self):
+        return hash((self.buckets, self.seed))
+    # end: __hash__
+
+    def config(self):
+        """
+        Get the settings of this vocabulary, from which the same vocabulary can be created again.
+        :return: The dictionary of the keyword arguments of the constructor.
+        """
+        return {"buckets": self.buckets, "seed": self.seed}
+    # end: config
+
+    def get_id(self, term):
+        """
+        Get the id of a term.
+        The hash (CRC-32) is the same in every process, unlike the built-in hash of a string, so that shards counted
+        by other processes and saved models line up.
+        :param term: The term to look up.
+        :return: The id (bucket) of the term.
+        """
+        return zlib.crc32(term.encode("utf-8"), self.seed) % self.buckets
+    # end: get_id
+
+    def hash_tokens(self, tokens):
+        """
+        Get the ids of the provided tokens.
+        :param tokens: The tokens to look up.
+        :return: The list of term ids.
+        """
+        crc32 = zlib.crc32
+        seed = self.seed
+        buckets = self.buckets
+        return [crc32(token.encode("utf-8"), seed) % buckets for token in tokens]
+    # end: hash_tokens
+
+    def get_ids(self, tokens):
+        """
+        Get the ids of the provided tokens.
+        :param tokens: The tokens to look up.
+        :return: The array of term ids.
+        """
+        return np.array(self.hash_tokens(tokens), dtype=np.int64)
+    # end: get_ids
+
+    def transform(self, documents):
+        """
+        Convert a batch of tokenized documents into a sparse document-term matrix (see Vocabulary.transform).
+        :param documents: The list of documents, each one being a list of tokens.
+        :return: The DocumentTermMatrix of the documents.
+        """
+        indptr = np.zeros(len(documents) + 1, dtype=np.int64)
+        indices = []
+        for i, tokens in enumerate(documents):
+            indices.extend(self.hash_tokens(tokens))
+            indptr[i + 1] = len(indices)
+        # end: for-loop
+
+        indices = np.array(indices, dtype=np.int64)
+        return DocumentTermMatrix(indptr, indices, np.ones(len(indices)), self.buckets)
+    # end: transform
+
+    def count_array(self, term_counts):
+        """
+        Convert a dictionary of term counts into a dense array indexed by term id.
+        :param term_counts: The dictionary of terms and their counts. The terms can also be given as their ids
+                            already (see Corpus, which counts the ids directly when hashing).
+        :return: The array of counts, of the same length as the vocabulary.
+        """
+        ids = [term if isinstance(term, int) else self.get_id(term) for term in term_counts]
+        counts = np.fromiter(term_counts.values(), dtype=float, count=len(term_counts))
+        return np.bincount(np.array(ids, dtype=np.int64), weights=counts, minlength=self.buckets)
+    # end: count_array
+# end: class HashingVocabulary
+
+
+class DocumentTermMatrix:
+    """
+    A sparse matrix of term counts, with one row per document and one column per term of a vocabulary.
+    The matrix is stored in the compressed sparse row format: the term ids and counts of row i are found at
+    indices[indptr[i]:indptr[i + 1]] and counts[indptr[i]:indptr[i + 1]].
+    """
+
+    def __init__(self, indptr, indices, counts, n_terms):
+        """
+        Constructor for the DocumentTermMatrix class.
+        :param indptr: The array of row offsets (of length n_documents + 1).
+        :param indices: The array of term ids.
+        :param counts: The array of counts for each of the term ids.
+        :param n_terms: The number of columns (i.e. the vocabulary size).
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.counts = counts
+        self.n_terms = n_terms
+    # end: __init__
+
+    def __len__(self):
+        return len(self.indptr) - 1
+    # end: __len__
+
+    def row_ids(self):
+        """
+        Get the row (document) index of every stored entry.
+        :return: The array of row indices, of the same length as the indices.
+        """
+        return np.repeat(np.arange(len(self)), np.diff(self.indptr))
+    # end: row_ids
+
+    def row_sums(self):
+        """
+        Get the total count of the terms in each row.
+        :return: The array of row sums, of length n_documents.
+        """
+        return np.bincount(self.row_ids(), weights=self.counts, minlength=len(self))
+    # end: row_sums
+
+    def take(self, rows):
+        """
+        Get the matrix made up of the provided rows of this matrix.
+        :param rows: The array of row (document) indices.
+        :return: The DocumentTermMatrix of the rows.
+        """
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+
+        # Find where each of the entries of the new matrix is in this one
+        entries = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+        return DocumentTermMatrix(indptr, self.indices[entries], self.counts[entries], self.n_terms)
+    # end: take
+
+    def dot(self, weights):
+        """
+        Multiply this matrix by the transpose of the provided weights, i.e. sum up the weights of every term of every
+        document for every row of the weights.
+        :param weights: The array of weights, of shape (n_rows, n_terms).
+        :return: The array of results, of shape (n_documents, n_rows).
+        """
+        row_ids = self.row_ids()
+        results = np.zeros((len(self), weights.shape[0]))
+        for i in range(weights.shape[0]):
+            results[:, i] = np.bincount(row_ids, weights=weights[i, self.indices] * self.counts, minlength=len(self))
+        # end: for-loop
+
+        return results
+    # end: dot
+# end: class DocumentTermMatrix